@@ -0,0 +1,233 @@
+# arbitrage.py
+# Scans every cached (make, model, city) file for price and price/km
+# distributions and ranks the widest buy-city/sell-city spreads per model.
+# Per-file stats are kept between scans and only files written or removed
+# since the last scan are re-read; a full rebuild fans out over a process pool.
+import csv
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+import cache_index
+import state
+
+try:
+    import numpy as np
+except ImportError:  # pure-Python fallback
+    np = None
+
+METRICS = ("price", "price_per_km")
+
+# Below this many files a rebuild runs in-process; spawning workers costs more
+PARALLEL_THRESHOLD = 64
+
+@dataclass(slots=True)
+class CityStats:
+    make: str
+    model: str
+    city: str
+    count: int
+    price_min: float
+    price_p25: float
+    price_median: float
+    price_p75: float
+    price_mean: float
+    ppk_min: float
+    ppk_median: float
+    ppk_mean: float
+    version: int = 0
+
+    def value(self, metric):
+        return self.price_median if metric == "price" else self.ppk_median
+
+    def to_wire(self):
+        return asdict(self)
+
+# make, model and city from a cache filename (see car_fetching.cache_filename)
+def parse_filename(filename):
+    parts = os.path.basename(filename)[:-len(".csv")].split("_", 2)
+    return tuple(parts) if len(parts) == 3 else None
+
+def _percentiles(values, qs):
+    # Linear interpolation between closest ranks, as numpy.percentile does
+    ordered = sorted(values)
+    last = len(ordered) - 1
+    out = []
+    for q in qs:
+        k = last * q / 100
+        lo = int(k)
+        hi = min(lo + 1, last)
+        out.append(ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo))
+    return out
+
+def _summarize(prices, mileages):
+    if np is not None:
+        price = np.asarray(prices, dtype=np.float64)
+        miles = np.asarray(mileages, dtype=np.float64)
+        ppk = price[miles > 0] / miles[miles > 0]
+        p25, p50, p75 = np.percentile(price, (25, 50, 75))
+        ppk_stats = (float(ppk.min()), float(np.median(ppk)), float(ppk.mean())) if ppk.size else (0.0, 0.0, 0.0)
+        return (float(price.min()), float(p25), float(p50), float(p75), float(price.mean()), *ppk_stats)
+    ppk = [p / m for p, m in zip(prices, mileages) if m > 0]
+    p25, p50, p75 = _percentiles(prices, (25, 50, 75))
+    ppk_stats = (min(ppk), _percentiles(ppk, (50,))[0], sum(ppk) / len(ppk)) if ppk else (0.0, 0.0, 0.0)
+    return (min(prices), p25, p50, p75, sum(prices) / len(prices), *ppk_stats)
+
+# Stats for one cached file, or None if it holds no priced listings. Runs in
+# worker processes during a rebuild, so it only takes a path.
+def file_stats(path):
+    key = parse_filename(path)
+    if key is None:
+        return None
+    prices, mileages = [], []
+    try:
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header:
+                return None
+            price_col, mileage_col = header.index("price"), header.index("mileage")
+            for row in reader:
+                try:
+                    price = float(row[price_col])
+                    mileage = float(row[mileage_col] or 0)
+                except (ValueError, IndexError):
+                    continue
+                if price > 0:
+                    prices.append(price)
+                    mileages.append(mileage)
+    except (OSError, ValueError):
+        return None
+    if not prices:
+        return None
+    return CityStats(*key, len(prices), *_summarize(prices, mileages))
+
+# Top spreads between cities, as (buy index, sell index, spread) with buy cheaper
+def _rank_pairs(values, top):
+    n = len(values)
+    if n < 2:
+        return []
+    if np is not None:
+        v = np.asarray(values)
+        spread = v[None, :] - v[:, None]  # [buy, sell]
+        flat = spread.ravel()
+        k = min(top, n * (n - 1) // 2)
+        idx = np.argpartition(-flat, k - 1)[:k]
+        idx = idx[np.argsort(-flat[idx], kind="stable")]
+        return [(int(i // n), int(i % n), float(flat[i])) for i in idx if flat[i] > 0]
+    pairs = [(i, j, values[j] - values[i]) for i in range(n) for j in range(n) if values[j] > values[i]]
+    pairs.sort(key=lambda p: -p[2])
+    return pairs[:top]
+
+class ArbitrageScanner:
+    def __init__(self):
+        self.stats = {}      # filename -> CityStats
+        self.dirty = set()   # filenames written or removed since their stats were computed
+        self.built = False
+        self.lock = threading.Lock()
+        self.rebuild_lock = threading.Lock()
+
+    def mark_dirty(self, filename):
+        if filename.endswith(".csv"):
+            with self.lock:
+                self.dirty.add(filename)
+
+    # Recompute stats for every cached file, across a process pool for large caches
+    def rebuild(self, workers=None):
+        with self.rebuild_lock:
+            self._rebuild(workers)
+
+    def _rebuild(self, workers):
+        with self.lock:
+            self.dirty.clear()
+        files = cache_index.files()
+        paths = [os.path.join(state.CACHE_DIR, f) for f in files]
+        workers = workers or os.cpu_count() or 1
+        if len(paths) >= PARALLEL_THRESHOLD and workers > 1:
+            # spawn, not fork: the node process is multi-threaded
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results = list(pool.map(file_stats, paths, chunksize=max(1, len(paths) // (workers * 4))))
+        else:
+            results = [file_stats(path) for path in paths]
+        stats = {}
+        for filename, result in zip(files, results):
+            if result is not None:
+                result.version = cache_index.version(filename) or 0
+                stats[filename] = result
+        with self.lock:
+            self.stats = stats
+            self.built = True
+        print(f"[Arbitrage] Indexed {len(stats)} of {len(files)} cached files")
+
+    # Re-read only the files that changed since the last scan
+    def refresh(self):
+        if not self.built:
+            with self.rebuild_lock:
+                if not self.built:
+                    self._rebuild(None)
+                    return
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+        for filename in dirty:
+            result = file_stats(os.path.join(state.CACHE_DIR, filename))
+            with self.lock:
+                if result is None:
+                    self.stats.pop(filename, None)
+                else:
+                    result.version = cache_index.version(filename) or 0
+                    self.stats[filename] = result
+
+    # Ranked spreads per (make, model), widest first
+    def scan(self, make=None, model=None, metric="price", top=10, pairs=3, min_listings=3, rank_by="spread"):
+        self.refresh()
+        with self.lock:
+            stats = list(self.stats.values())
+        groups = {}
+        for s in stats:
+            if make and s.make != make.lower():
+                continue
+            if model and s.model != model.lower():
+                continue
+            if s.count >= min_listings and s.value(metric) > 0:
+                groups.setdefault((s.make, s.model), []).append(s)
+
+        results = []
+        for (mk, md), cities in groups.items():
+            cities.sort(key=lambda s: s.city)
+            values = [s.value(metric) for s in cities]
+            ranked = []
+            for buy, sell, spread in _rank_pairs(values, pairs):
+                ranked.append({
+                    "buy_city": cities[buy].city,
+                    "sell_city": cities[sell].city,
+                    "buy_median": values[buy],
+                    "sell_median": values[sell],
+                    "spread": spread,
+                    "spread_pct": spread / values[buy] * 100,
+                    "buy_listings": cities[buy].count,
+                    "sell_listings": cities[sell].count,
+                })
+            if ranked:
+                results.append({"make": mk, "model": md, "cities": len(cities), "best": ranked[0], "pairs": ranked})
+        results.sort(key=lambda r: -r["best"][rank_by])
+        return {
+            "metric": metric,
+            "vectorized": np is not None,
+            "files": len(stats),
+            "models": results[:top],
+        }
+
+    # Per-city distributions for one model
+    def distributions(self, make, model):
+        self.refresh()
+        with self.lock:
+            rows = [s.to_wire() for s in self.stats.values() if s.make == make.lower() and s.model == model.lower()]
+        return sorted(rows, key=lambda r: r["price_median"])
+
+SCANNER = ArbitrageScanner()
+
+# Follow cache writes and evictions, and index the cache in the background
+def start_scanner():
+    cache_index.subscribe(SCANNER.mark_dirty)
+    threading.Thread(target=SCANNER.rebuild, daemon=True).start()
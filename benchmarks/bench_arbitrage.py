@@ -0,0 +1,99 @@
+# bench_arbitrage.py
+# Full-cache arbitrage scan over a synthetic cache directory: rebuild time
+# in-process and across a process pool, the cost of picking up one changed
+# file, and the time to rank spreads from the kept stats:
+# python benchmarks/bench_arbitrage.py [--makes 5] [--models 5] [--cities 40] [--rows 500] [--workers N] [--json]
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import arbitrage
+import cache_index
+import state
+from models import LISTING_FIELDS
+
+def write_cache(directory, makes, models, cities, rows, seed=1):
+    rng = random.Random(seed)
+    count = 0
+    for m in range(makes):
+        for d in range(models):
+            base = rng.randint(10000, 30000)
+            for c in range(cities):
+                # Each city sits a few percent above or below the model's base price
+                city_base = base * rng.uniform(0.85, 1.15)
+                with open(os.path.join(directory, f"make{m}_model{d}_city{c}.csv"), "w", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(LISTING_FIELDS)
+                    for _ in range(rows):
+                        writer.writerow((rng.randint(2008, 2024), f"Make{m}", f"Model{d}",
+                                         round(city_base * rng.uniform(0.7, 1.3)), rng.randint(7000, 250000), f"City{c}"))
+                count += 1
+    return count
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--makes", type=int, default=5)
+    parser.add_argument("--models", type=int, default=5)
+    parser.add_argument("--cities", type=int, default=40)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    state.CACHE_DIR = tempfile.mkdtemp(prefix="carbitrage-arb-")
+    try:
+        files = write_cache(state.CACHE_DIR, args.makes, args.models, args.cities, args.rows)
+        cache_index.build()
+
+        serial = timed(arbitrage.ArbitrageScanner().rebuild, 1)
+        scanner = arbitrage.ArbitrageScanner()
+        parallel = timed(scanner.rebuild, args.workers)
+
+        # One file rewritten, then the next scan picks it up
+        changed = "make0_model0_city0.csv"
+        scanner.mark_dirty(changed)
+        incremental = timed(scanner.refresh)
+        start = time.perf_counter()
+        top = scanner.scan(top=5)
+        scan = time.perf_counter() - start
+
+        results = {
+            "files": files,
+            "rows_per_file": args.rows,
+            "numpy": arbitrage.np is not None,
+            "workers": args.workers,
+            "rebuild_serial_s": serial,
+            "rebuild_parallel_s": parallel,
+            "refresh_one_file_ms": incremental * 1000,
+            "rank_ms": scan * 1000,
+            "widest": [(m["make"], m["model"], m["best"]["buy_city"], m["best"]["sell_city"], round(m["best"]["spread"])) for m in top["models"]],
+        }
+    finally:
+        shutil.rmtree(state.CACHE_DIR, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{files} files x {args.rows} rows (numpy: {results['numpy']}, workers: {args.workers})")
+    print(f"  full rebuild, in-process   {serial:8.2f} s")
+    print(f"  full rebuild, process pool {parallel:8.2f} s")
+    print(f"  refresh after one write    {incremental * 1000:8.2f} ms")
+    print(f"  rank spreads               {scan * 1000:8.2f} ms")
+    for make, model, buy, sell, spread in results["widest"]:
+        print(f"  {make} {model}: buy in {buy}, sell in {sell} (+${spread})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# bench_memory.py
+# Resident memory of a node-sized listing cache and Raft log, comparing plain
+# dict/class records against the slotted, interned ones:
+# python benchmarks/bench_memory.py [--files 200] [--rows 500] [--entries 5000] [--json]
+import argparse
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Listing
+from raft import LogEntry
+
+MAKES = {"Toyota": ["Corolla", "Camry", "RAV4"], "Honda": ["Civic", "Accord", "CR-V"], "Ford": ["Focus", "Escape", "F-150"]}
+CITIES = ["Toronto, ON", "Mississauga, ON", "Ottawa, ON", "Montreal, QC", "Vancouver, BC", "Calgary, AB"]
+
+# Previous log entry layout, kept here only as the baseline
+class DictLogEntry:
+    def __init__(self, term, command, index):
+        self.term = term
+        self.command = command
+        self.index = index
+
+# Rows as they come off csv.DictReader: every string is a fresh object
+def raw_rows(n, seed):
+    rng = random.Random(seed)
+    for _ in range(n):
+        make = rng.choice(list(MAKES))
+        yield (rng.randint(2008, 2024), "".join(make), "".join(rng.choice(MAKES[make])),
+               float(rng.randint(8000, 35000)), float(rng.randint(7000, 250000)), "".join(rng.choice(CITIES)))
+
+def build_dict_cache(files, rows):
+    keys = ("year", "make", "model", "price", "mileage", "location")
+    return [[dict(zip(keys, row)) for row in raw_rows(rows, i)] for i in range(files)]
+
+def build_listing_cache(files, rows):
+    return [[Listing.create(*row) for row in raw_rows(rows, i)] for i in range(files)]
+
+def build_log(entry_cls, entries):
+    cls = LogEntry if entry_cls == "slotted" else DictLogEntry
+    return [cls(1, {"type": "".join("set_leader"), "leader_id": 217}, i + 1) for i in range(entries)]
+
+def measure(build, *args):
+    tracemalloc.start()
+    obj = build(*args)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return current
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = {
+        "cache_dict_bytes": measure(build_dict_cache, args.files, args.rows),
+        "cache_listing_bytes": measure(build_listing_cache, args.files, args.rows),
+        "log_dict_bytes": measure(build_log, "dict", args.entries),
+        "log_slotted_bytes": measure(build_log, "slotted", args.entries),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    listings = args.files * args.rows
+    print(f"cache ({listings} listings): dict {results['cache_dict_bytes'] / 2**20:.1f} MiB -> "
+          f"Listing {results['cache_listing_bytes'] / 2**20:.1f} MiB")
+    print(f"log ({args.entries} entries): class {results['log_dict_bytes'] / 2**20:.2f} MiB -> "
+          f"slotted {results['log_slotted_bytes'] / 2**20:.2f} MiB")
+
+if __name__ == "__main__":
+    main()
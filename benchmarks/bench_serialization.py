@@ -0,0 +1,91 @@
+# bench_serialization.py
+# Compare CPU time and bytes on the wire for heartbeat and /client payloads
+# across the available codecs: python benchmarks/bench_serialization.py [--json]
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Synthetic listings shaped like fetch_cars output
+def make_listings(n, seed=0):
+    rng = random.Random(seed)
+    cities = ["Toronto, ON", "Mississauga, ON", "Brampton, ON", "Markham, ON"]
+    return [{
+        "year": rng.randint(2008, 2024),
+        "make": "Toyota",
+        "model": "Corolla",
+        "price": float(rng.randint(8000, 35000)),
+        "mileage": float(rng.randint(7000, 250000)),
+        "location": rng.choice(cities),
+    } for _ in range(n)]
+
+# A replicate_file command carrying a whole CSV, as appended by replicate_to_followers
+def make_csv(listings):
+    lines = ["year,make,model,price,mileage,location"]
+    for car in listings:
+        lines.append(f"{car['year']},{car['make']},{car['model']},{car['price']},{car['mileage']},\"{car['location']}\"")
+    return "\r\n".join(lines) + "\r\n"
+
+def make_heartbeat(num_entries, rows_per_file, compact):
+    entries = []
+    for i in range(num_entries):
+        command = {"type": "replicate_file", "filename": f"toyota_corolla_city{i}.csv", "data": make_csv(make_listings(rows_per_file, i))}
+        entries.append((3, command) if compact else {"term": 3, "command": command})
+    return {"term": 3, "leader_id": 217, "prev_log_index": 10, "prev_log_term": 3, "entries": entries, "leader_commit": 10}
+
+def make_client_response(per_city):
+    return {"leader_id": 217, "results": {"toronto": make_listings(per_city, 1), "ottawa": make_listings(per_city, 2)}}
+
+def codecs():
+    out = {"json": (lambda o: json.dumps(o).encode(), json.loads)}
+    if orjson is not None:
+        out["orjson"] = (orjson.dumps, orjson.loads)
+    if msgpack is not None:
+        out["msgpack"] = (lambda o: msgpack.packb(o, use_bin_type=True), lambda b: msgpack.unpackb(b, raw=False))
+    return out
+
+def measure(encode, decode, payload, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        blob = encode(payload)
+    encode_s = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode(blob)
+    decode_s = (time.perf_counter() - start) / repeat
+    return {"bytes": len(blob), "encode_us": encode_s * 1e6, "decode_us": decode_s * 1e6}
+
+def main():
+    payloads = {
+        "heartbeat_empty": (make_heartbeat(0, 0, True), 2000),
+        "heartbeat_dict_entries": (make_heartbeat(5, 500, False), 50),
+        "heartbeat_compact_entries": (make_heartbeat(5, 500, True), 50),
+        "client_response_1000": (make_client_response(500), 50),
+    }
+    results = []
+    for payload_name, (payload, repeat) in payloads.items():
+        for codec_name, (encode, decode) in codecs().items():
+            results.append({"payload": payload_name, "codec": codec_name, **measure(encode, decode, payload, repeat)})
+
+    if "--json" in sys.argv:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'payload':<28}{'codec':<10}{'bytes':>10}{'encode us':>12}{'decode us':>12}")
+    for r in results:
+        print(f"{r['payload']:<28}{r['codec']:<10}{r['bytes']:>10}{r['encode_us']:>12.1f}{r['decode_us']:>12.1f}")
+
+if __name__ == "__main__":
+    main()
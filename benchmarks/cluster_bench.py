@@ -0,0 +1,297 @@
+# cluster_bench.py
+# Launch an N-node cluster on localhost against the MarketCheck stub, drive
+# /client load and write machine-readable results:
+#   python benchmarks/cluster_bench.py --nodes 3 --requests 300 --out bench.json
+#   python benchmarks/cluster_bench.py --compare before.json after.json
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_marketcheck import StubSettings, serve
+
+CITIES = ["toronto", "ottawa", "montreal", "vancouver", "calgary", "halifax"]
+MAKES = {"toyota": ["corolla", "camry", "rav4"], "honda": ["civic", "accord"], "ford": ["escape", "focus"]}
+
+class Cluster:
+    def __init__(self, num_nodes, base_port, stub_url, workdir):
+        self.nodes = {100 + i: f"localhost:{base_port + i}" for i in range(1, num_nodes + 1)}
+        self.workdir = workdir
+        self.env = dict(
+            os.environ,
+            MARKETCHECK_BASE_URL=stub_url,
+            CARBITRAGE_CLUSTER=",".join(f"{nid}={addr}" for nid, addr in self.nodes.items()),
+            PYTHONUNBUFFERED="1",
+        )
+        self.procs = {}
+
+    def start(self, nid):
+        log = open(os.path.join(self.workdir, f"node_{nid}.log"), "w")
+        self.procs[nid] = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, "main.py"), str(nid)],
+            cwd=self.workdir, env=self.env, stdout=log, stderr=subprocess.STDOUT,
+        )
+
+    def kill(self, nid):
+        proc = self.procs.pop(nid, None)
+        if proc:
+            proc.send_signal(signal.SIGKILL)
+            proc.wait()
+
+    def stop(self):
+        for nid in list(self.procs):
+            self.kill(nid)
+
+    def url(self, nid):
+        return f"http://{self.nodes[nid]}"
+
+    # Leader agreed on by every running node, or None
+    def leader(self, exclude=()):
+        seen = set()
+        for nid in self.procs:
+            if nid in exclude:
+                continue
+            try:
+                seen.add(requests.get(f"{self.url(nid)}/leader", timeout=0.5).json().get("leader_id"))
+            except requests.exceptions.RequestException:
+                return None
+        if len(seen) == 1 and None not in seen and seen.issubset(self.procs):
+            return seen.pop()
+        return None
+
+    def wait_for_leader(self, timeout=60.0, exclude=()):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            leader = self.leader(exclude)
+            if leader is not None and leader not in exclude:
+                return leader
+            time.sleep(0.1)
+        raise RuntimeError("No leader elected in time")
+
+    # Poll /ready on every node; returns each node's self-reported start-to-ready time
+    def wait_for_ready(self, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        pending, reported = set(self.procs), {}
+        while pending and time.monotonic() < deadline:
+            for nid in list(pending):
+                try:
+                    res = requests.get(f"{self.url(nid)}/ready", timeout=0.5)
+                except requests.exceptions.RequestException:
+                    continue
+                if res.status_code == 200:
+                    reported[nid] = res.json().get("startup_seconds")
+                    pending.discard(nid)
+            time.sleep(0.05)
+        if pending:
+            raise RuntimeError(f"Nodes {sorted(pending)} never became ready")
+        return reported
+
+    def metrics(self, nid):
+        text = requests.get(f"{self.url(nid)}/metrics", timeout=2).text
+        values = {}
+        for line in text.splitlines():
+            if line.startswith("#") or not line.strip():
+                continue
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+        return values
+
+def metric_sum(values, pattern):
+    regex = re.compile(pattern)
+    return sum(v for k, v in values.items() if regex.fullmatch(k))
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+# Queries drawn from a fixed pool so repeats exercise the cache
+def make_workload(count, distinct, seed):
+    rng = random.Random(seed)
+    pool = []
+    for _ in range(distinct):
+        make = rng.choice(list(MAKES))
+        city1, city2 = rng.sample(CITIES, 2)
+        pool.append({"country": "ca", "city1": city1, "city2": city2, "make": make, "model": rng.choice(MAKES[make])})
+    return [rng.choice(pool) for _ in range(count)]
+
+def run_load(cluster, leader, workload, concurrency):
+    session = requests.Session()
+    state = {"leader": leader}
+
+    def one(payload):
+        start = time.perf_counter()
+        try:
+            res = session.post(f"{cluster.url(state['leader'])}/client", json=payload, timeout=120)
+            data = res.json()
+            if "error" in data:
+                if data.get("leader_id") in cluster.nodes:
+                    state["leader"] = data["leader_id"]
+                return None
+            return time.perf_counter() - start
+        except requests.exceptions.RequestException:
+            return None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, workload))
+    elapsed = time.perf_counter() - started
+    latencies = [r for r in results if r is not None]
+    return latencies, len(results) - len(latencies), elapsed
+
+# Time until every follower has applied the leader's whole log
+def wait_for_replication(cluster, leader, timeout=30.0):
+    target = cluster.metrics(leader)["carbitrage_raft_log_entries"]
+    lag = max((v for k, v in cluster.metrics(leader).items() if k.startswith("carbitrage_raft_replication_lag_entries{")), default=0.0)
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        behind = [nid for nid in cluster.procs if cluster.metrics(nid)["carbitrage_raft_commit_index"] < target]
+        if not behind:
+            return lag, time.monotonic() - start
+        time.sleep(0.05)
+    return lag, None
+
+def measure_failover(cluster, leader):
+    cluster.kill(leader)
+    start = time.monotonic()
+    new_leader = cluster.wait_for_leader(exclude=(leader,))
+    return new_leader, time.monotonic() - start
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except Exception:
+        return None
+
+def run(args):
+    settings = StubSettings(args.stub_latency_ms, args.stub_jitter_ms, args.stub_pages, args.stub_error_rate)
+    stub = serve(args.stub_port, settings)
+    stub_url = f"http://127.0.0.1:{args.stub_port}/v2/search/car/active"
+    workdir = tempfile.mkdtemp(prefix="carbitrage-bench-")
+    cluster = Cluster(args.nodes, args.base_port, stub_url, workdir)
+    try:
+        started = time.monotonic()
+        for nid in cluster.nodes:
+            cluster.start(nid)
+        leader = cluster.wait_for_leader()
+        startup_s = time.monotonic() - started
+        node_ready = cluster.wait_for_ready()
+        ready_s = time.monotonic() - started
+        print(f"[Bench] {args.nodes} nodes up, leader {leader} after {startup_s:.2f}s, all ready after {ready_s:.2f}s")
+
+        before = cluster.metrics(leader)
+        workload = make_workload(args.requests, args.distinct_queries, args.seed)
+        latencies, errors, elapsed = run_load(cluster, leader, workload, args.concurrency)
+        after = cluster.metrics(leader)
+        hits = metric_sum(after, r'carbitrage_client_request_seconds_count\{cache="hit"\}') - metric_sum(before, r'carbitrage_client_request_seconds_count\{cache="hit"\}')
+        misses = metric_sum(after, r'carbitrage_client_request_seconds_count\{cache="miss"\}') - metric_sum(before, r'carbitrage_client_request_seconds_count\{cache="miss"\}')
+        lag, catchup_s = wait_for_replication(cluster, leader)
+
+        results = {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("compare", "out")},
+            "startup_to_leader_s": startup_s,
+            "startup_to_ready_s": ready_s,
+            "node_startup_to_ready_s": {
+                "max": max(v for v in node_ready.values() if v is not None) if any(node_ready.values()) else None,
+            },
+            "requests": len(workload),
+            "errors": errors,
+            "throughput_rps": len(latencies) / elapsed if elapsed else None,
+            "latency_ms": {
+                "mean": statistics.mean(latencies) * 1000 if latencies else None,
+                "p50": percentile(latencies, 0.50) * 1000 if latencies else None,
+                "p90": percentile(latencies, 0.90) * 1000 if latencies else None,
+                "p99": percentile(latencies, 0.99) * 1000 if latencies else None,
+                "max": max(latencies) * 1000 if latencies else None,
+            },
+            "cache_hit_ratio": hits / (hits + misses) if hits + misses else None,
+            "replication_lag_max_entries": lag,
+            "replication_catchup_s": catchup_s,
+            "stub": {"requests": settings.requests, "errors": settings.errors},
+        }
+        if args.failover and args.nodes >= 3:
+            new_leader, failover_s = measure_failover(cluster, leader)
+            print(f"[Bench] Leader {leader} killed, Node {new_leader} took over after {failover_s:.2f}s")
+            results["failover_s"] = failover_s
+        return results
+    finally:
+        cluster.stop()
+        stub.shutdown()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(f"[Bench] Node logs kept in {workdir}")
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+# Side-by-side view of two result files
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = flatten(json.load(f))
+    with open(new_path) as f:
+        new = flatten(json.load(f))
+    print(f"{'metric':<36}{'old':>14}{'new':>14}{'change':>10}")
+    for key in sorted(set(old) & set(new)):
+        if key.startswith("config.") or key == "timestamp":
+            continue
+        change = f"{(new[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else ""
+        print(f"{key:<36}{old[key]:>14.3f}{new[key]:>14.3f}{change:>10}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=9100)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--distinct-queries", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stub-port", type=int, default=9000)
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--stub-pages", type=int, default=4)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--no-failover", dest="failover", action="store_false")
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main()
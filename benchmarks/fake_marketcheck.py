@@ -0,0 +1,113 @@
+# fake_marketcheck.py
+# Stand-in for the MarketCheck active search API with configurable latency,
+# inventory size, error rate and churn (share of listings repriced per epoch):
+# python benchmarks/fake_marketcheck.py --port 9000 --latency-ms 50 --pages 4 --error-rate 0.01
+# python benchmarks/fake_marketcheck.py --churn 0.05 --churn-every 60
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MODELS = {
+    "toyota": ["Corolla", "Camry", "RAV4", "Prius", "Tacoma"],
+    "honda": ["Civic", "Accord", "CR-V", "Fit", "Pilot"],
+    "ford": ["Focus", "Fusion", "Escape", "Mustang", "F-150"],
+}
+
+class StubSettings:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, pages=4, error_rate=0.0, churn=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.pages = pages
+        self.error_rate = error_rate
+        self.churn = churn
+        self.epoch = 0
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+# Price drops a listing has taken by this epoch
+def _repricings(key, settings):
+    return sum(
+        random.Random(zlib.crc32(f"{key}|{epoch}".encode())).random() < settings.churn
+        for epoch in range(1, settings.epoch + 1)
+    )
+
+# Deterministic listings for a (city, make, start) page
+def make_page(city, make, start, rows, settings):
+    total = settings.pages * rows
+    rng = random.Random(zlib.crc32(f"{city}|{make}|{start}".encode()))
+    listings = []
+    for i in range(start, min(start + rows, total)):
+        model = rng.choice(MODELS.get(make.lower(), ["Model"]))
+        key = f"{city}-{make}-{i}"
+        price = rng.randint(8000, 40000)
+        if settings.churn:
+            price -= 250 * _repricings(key, settings)
+        listings.append({
+            "id": key,
+            "price": price,
+            "miles": rng.randint(5000, 250000),
+            "build": {"year": rng.randint(2008, 2024), "make": make.title(), "model": model},
+            "dealer": {"city": city.title(), "state": "ON"},
+        })
+    return {"num_found": total, "listings": listings}
+
+def make_handler(settings):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            delay = settings.latency_ms + random.uniform(0, settings.jitter_ms)
+            time.sleep(delay / 1000)
+            with settings.lock:
+                settings.requests += 1
+                failed = random.random() < settings.error_rate
+                settings.errors += failed
+            if failed:
+                self.send_response(503)
+                self.end_headers()
+                return
+            body = json.dumps(make_page(
+                params.get("city", ""), params.get("make", ""),
+                int(params.get("start", 0)), int(params.get("rows", 50)), settings,
+            )).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+# Start the stub on a background thread, returning the server
+def serve(port, settings):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(settings))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--churn", type=float, default=0.0)
+    parser.add_argument("--churn-every", type=float, default=60.0)
+    args = parser.parse_args()
+    settings = StubSettings(args.latency_ms, args.jitter_ms, args.pages, args.error_rate, args.churn)
+    serve(args.port, settings)
+    print(f"[Stub] MarketCheck stub on http://127.0.0.1:{args.port}/v2/search/car/active")
+    while True:
+        time.sleep(args.churn_every if args.churn else 3600)
+        settings.epoch += 1
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# cache_delta.py
+# Incremental refresh of cache files. A re-crawl is diffed by listing id
+# against the copy it replaces, and only the added, changed and removed rows go
+# through the Raft log as a replicate_delta command, tagged with the version it
+# applies to. A replica holding that base version patches its copy; any other
+# replica pulls the full file from the leader instead.
+import csv
+import hashlib
+import io
+import os
+import threading
+import time
+import requests
+import cache_index
+import cache_store
+import raft_instance
+import state
+from metrics import Counter
+
+DELTA_RESULTS = Counter("carbitrage_delta_applied_total", "replicate_delta commands handled on this node", labels=("result",))
+
+# Past this share of changed rows the full file is smaller than the delta
+MAX_DELTA_FRACTION = 0.5
+
+# Pulls of one file give up after this many tries and leave it to reconcile
+MAX_PULL_ATTEMPTS = 10
+
+# Files whose base version was missing here, waiting for a full pull
+# (name -> (version, attempts))
+_wanted = {}
+_wanted_lock = threading.Condition()
+_puller = None
+
+def _parse(data):
+    rows = list(csv.reader(io.StringIO(data.decode(), newline="")))
+    return (rows[0], rows[1:]) if rows else (None, [])
+
+def _encode(header, rows):
+    buffer = io.StringIO(newline="")
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+# Added/changed rows and removed ids turning base into new, or None when the
+# two can't be diffed (no id column, different columns) or most rows changed
+def diff(base, new):
+    base_header, base_rows = _parse(base)
+    new_header, new_rows = _parse(new)
+    if base_header != new_header or not new_header or "id" not in new_header:
+        return None
+    id_col = new_header.index("id")
+    old = {row[id_col]: row for row in base_rows}
+    current = {row[id_col] for row in new_rows}
+    if len(old) != len(base_rows) or len(current) != len(new_rows):
+        return None
+    upserts = [row for row in new_rows if old.get(row[id_col]) != row]
+    removed = [row_id for row_id in old if row_id not in current]
+    if len(upserts) + len(removed) > MAX_DELTA_FRACTION * max(len(new_rows), 1):
+        return None
+    return {"fields": new_header, "upserts": upserts, "removed": removed}
+
+# Base with the delta applied: rows keep their order, changed rows are replaced
+# in place, new rows go at the end. The leader writes this rather than the raw
+# crawl so every replica that patches its copy ends up with the same bytes.
+def apply(base, delta):
+    header, rows = _parse(base)
+    if header != delta["fields"]:
+        raise ValueError("delta columns do not match the base file")
+    id_col = header.index("id")
+    removed = set(delta["removed"])
+    upserts = {row[id_col]: row for row in delta["upserts"]}
+    out = []
+    for row in rows:
+        if row[id_col] in removed:
+            continue
+        out.append(upserts.pop(row[id_col], row))
+    out.extend(row for row in delta["upserts"] if row[id_col] in upserts)
+    return _encode(header, out)
+
+# Write a re-crawl over the current copy. Returns (meta, delta), delta None when
+# the file has to be replicated in full.
+def save_refresh(filename, data):
+    base, base_meta = cache_store.read_file(filename)
+    delta = diff(base, data) if base is not None else None
+    if delta is None:
+        return cache_store.write_file(filename, data), None
+    meta = cache_store.write_file(filename, apply(base, delta))
+    delta.update(base_version=base_meta.get("version"), version=meta["version"], sha256=meta["sha256"])
+    return meta, delta
+
+# Apply a replicate_delta command from the log
+def apply_command(command):
+    filename = os.path.basename(command["filename"])
+    version = command["version"]
+    base, meta = cache_store.read_file(filename)
+    if meta is not None and meta.get("version", 0) >= version:
+        # The leader wrote it, or a newer copy already arrived
+        DELTA_RESULTS.labels("skipped").inc()
+        return
+    if meta is not None and meta.get("version") == command.get("base_version"):
+        try:
+            data = apply(base, command)
+        except (ValueError, IndexError, KeyError) as e:
+            print(f"[Delta] Could not patch {filename}: {e}")
+            data = None
+        if data is not None and hashlib.sha256(data).hexdigest() == command.get("sha256"):
+            cache_store.write_file(filename, data, version)
+            DELTA_RESULTS.labels("patched").inc()
+            return
+    print(f"[Delta] {filename} is not at base version {command.get('base_version')}, pulling the full file")
+    _request_pull(filename, version)
+
+def _request_pull(filename, version):
+    global _puller
+    with _wanted_lock:
+        _wanted[filename] = (max(version, _wanted.get(filename, (0, 0))[0]), 0)
+        if _puller is None:
+            _puller = threading.Thread(target=_pull_loop, daemon=True)
+            _puller.start()
+        _wanted_lock.notify()
+
+# Fetch a file from the leader, if it has at least the wanted version
+def _pull(filename, version):
+    node = raft_instance.raft_node
+    leader_id = node.current_leader
+    if leader_id is None or leader_id == state.NODE_ID:
+        return False
+    leader_url = node.peer_url(leader_id)
+    meta = requests.get(f"{leader_url}/cache-meta", params={"filename": filename}, timeout=5).json()
+    if not isinstance(meta, dict) or (meta.get("version") or 0) < version:
+        return False
+    res = requests.get(f"{leader_url}/get-cache-file", params={"filename": filename}, timeout=10)
+    if res.status_code != 200 or not cache_store.matches(res.content, meta):
+        return False
+    cache_store.write_file(filename, res.content, meta["version"])
+    return True
+
+# Background pulls for files a delta couldn't patch; retried until the copy
+# here is at the wanted version, the file is evicted or the attempts run out
+def _pull_loop():
+    while True:
+        with _wanted_lock:
+            while not _wanted:
+                _wanted_lock.wait()
+            filename, (version, attempts) = next(iter(_wanted.items()))
+            del _wanted[filename]
+        if (cache_index.version(filename) or 0) >= version or cache_index.is_tombstoned(filename, version):
+            continue
+        try:
+            pulled = _pull(filename, version)
+        except Exception as e:
+            print(f"[Delta] Pull of {filename} failed: {e}")
+            pulled = False
+        if pulled:
+            DELTA_RESULTS.labels("pulled").inc()
+            print(f"[Delta] Pulled full {filename} from the leader")
+        elif attempts + 1 < MAX_PULL_ATTEMPTS:
+            time.sleep(1)
+            with _wanted_lock:
+                _wanted.setdefault(filename, (version, attempts + 1))
+        else:
+            print(f"[Delta] Giving up on {filename}, reconcile will catch it up")
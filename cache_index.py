@@ -0,0 +1,156 @@
+# cache_index.py
+# In-memory index of the cached CSV files, built once at startup and kept
+# current by the code paths that read, write or delete cache files. Besides
+# size, mtime and version (see cache_store.py) it tracks reads (last access,
+# hit count) for eviction, and tombstones for evicted files so reconcile does
+# not pull them back.
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+import state
+
+@dataclass(slots=True)
+class CacheEntry:
+    size: int
+    mtime: float
+    last_access: float
+    hits: int = 0
+    version: int = 0
+
+_files = {}
+_tombstones = {}
+_lock = threading.Lock()
+_built = False
+
+# Wall-clock start of this process, to tell its temp files from a previous
+# run's that happened to have the same pid (e.g. a restarted container)
+_STARTED = time.time()
+
+# Callbacks run with a filename whenever that file is written or removed
+_listeners = []
+
+def subscribe(callback):
+    _listeners.append(callback)
+
+def _notify(filename):
+    for callback in _listeners:
+        try:
+            callback(filename)
+        except Exception as e:
+            print(f"[Cache] Change listener failed for {filename}: {e}")
+
+def _read_version(path, mtime):
+    try:
+        with open(path + ".meta") as f:
+            return json.load(f)["version"]
+    except (OSError, ValueError, KeyError):
+        # Written before versions existed
+        return int(mtime * 1000)
+
+# Process id in a cache_store temp file name (<file>.<pid>.<thread>.tmp[.meta])
+def _tmp_owner(name):
+    parts = name.removesuffix(".meta").removesuffix(".tmp").rsplit(".", 2)
+    return parts[1] if len(parts) == 3 else None
+
+# Scan the cache directory into the index (mtime stands in for the last access),
+# removing temp files left behind by an interrupted write. Temp files created
+# by this process are kept: the Raft apply thread may already be staging a batch.
+def build():
+    global _built
+    entries = {}
+    pid = str(os.getpid())
+    for entry in os.scandir(state.CACHE_DIR):
+        if not entry.is_file():
+            continue
+        if entry.name.endswith((".tmp", ".tmp.meta")):
+            if _tmp_owner(entry.name) != pid or entry.stat().st_mtime < _STARTED:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        elif entry.name.endswith(".csv"):
+            st = entry.stat()
+            entries[entry.name] = CacheEntry(st.st_size, st.st_mtime, st.st_mtime, 0, _read_version(entry.path, st.st_mtime))
+    with _lock:
+        _files.clear()
+        _files.update(entries)
+        _built = True
+    return len(entries)
+
+def is_built():
+    return _built
+
+# Refresh one file's entry after it was written; a rewrite clears its tombstone
+def record(filename, version=None):
+    filename = os.path.basename(filename)
+    path = os.path.join(state.CACHE_DIR, filename)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return forget(filename)
+    if version is None:
+        version = _read_version(path, st.st_mtime)
+    with _lock:
+        entry = _files.get(filename)
+        if entry is None:
+            _files[filename] = CacheEntry(st.st_size, st.st_mtime, st.st_mtime, 0, version)
+        else:
+            entry.size, entry.mtime, entry.version = st.st_size, st.st_mtime, version
+        _tombstones.pop(filename, None)
+    _notify(filename)
+
+# Count a read of a cached file
+def touch(filename):
+    with _lock:
+        entry = _files.get(os.path.basename(filename))
+        if entry is not None:
+            entry.last_access = time.time()
+            entry.hits += 1
+
+def forget(filename):
+    filename = os.path.basename(filename)
+    with _lock:
+        _files.pop(filename, None)
+    _notify(filename)
+
+# Drop an evicted file from the index and remember when it was evicted
+def tombstone(filename, evicted_at=None):
+    filename = os.path.basename(filename)
+    with _lock:
+        _files.pop(filename, None)
+        _tombstones[filename] = evicted_at or time.time()
+    _notify(filename)
+
+# Whether a copy with this version (ms) was fetched before the file was evicted
+def is_tombstoned(filename, version=None):
+    with _lock:
+        evicted_at = _tombstones.get(filename)
+    return evicted_at is not None and (version is None or version / 1000 <= evicted_at)
+
+def tombstones():
+    with _lock:
+        return dict(_tombstones)
+
+def files():
+    with _lock:
+        return sorted(_files)
+
+def entries():
+    with _lock:
+        return {name: CacheEntry(e.size, e.mtime, e.last_access, e.hits, e.version) for name, e in _files.items()}
+
+def mtime(filename):
+    with _lock:
+        entry = _files.get(filename)
+    return entry.mtime if entry else None
+
+def version(filename):
+    with _lock:
+        entry = _files.get(filename)
+    return entry.version if entry else None
+
+def total_bytes():
+    with _lock:
+        return sum(entry.size for entry in _files.values())
@@ -0,0 +1,140 @@
+# cache_manager.py
+# Keeps each node's CACHE_DIR under CACHE_QUOTA_BYTES. The leader plans
+# evictions from its cache index and appends them to the Raft log as
+# evict_files commands, so every replica drops the same files in log order.
+# With sharding on, files are not replicated through the log, so each node
+# evicts its own shards directly.
+import os
+import threading
+import time
+import cache_index
+import cache_store
+import raft_instance
+from config import CACHE_EVICTION_INTERVAL, CACHE_EVICTION_POLICY, CACHE_QUOTA_BYTES, CACHE_TTL_HOURS, SHARDING_ENABLED
+from metrics import Counter
+from raft import NodeState
+from tracing import current_context, span
+
+CACHE_EVICTIONS = Counter("carbitrage_cache_evictions_total", "Cache files evicted", labels=("reason",))
+
+# Evict down to this fraction of the quota so one new file doesn't trigger another round
+LOW_WATERMARK = 0.9
+
+# Files evicted by a command that has not been applied yet (name -> time appended).
+# Entries older than PENDING_TIMEOUT belong to a command that was lost with a
+# leadership change and are planned again.
+PENDING_TIMEOUT = 60.0
+_pending = {}
+_pending_lock = threading.Lock()
+
+# Eviction order for files still within their TTL
+def _victim_key(policy):
+    if policy == "lfu":
+        return lambda item: (item[1].hits, item[1].last_access)
+    return lambda item: item[1].last_access
+
+# Files to evict, with the reason for each: expired files that nobody read
+# within the TTL always go; then, over quota, expired files before live ones,
+# least recently (lru) or least often (lfu) used first
+def plan_evictions(entries, quota=CACHE_QUOTA_BYTES, policy=CACHE_EVICTION_POLICY, ttl_hours=CACHE_TTL_HOURS, now=None):
+    now = now or time.time()
+    ttl = ttl_hours * 3600
+    expired = {name: e for name, e in entries.items() if now - e.mtime >= ttl}
+    victims = {name: "expired" for name, e in expired.items() if now - e.last_access >= ttl}
+
+    total = sum(e.size for name, e in entries.items() if name not in victims)
+    if total <= quota:
+        return victims
+    target = quota * LOW_WATERMARK
+    remaining = [(name, e) for name, e in entries.items() if name not in victims]
+    ordered = sorted((item for item in remaining if item[0] in expired), key=lambda item: item[1].last_access)
+    ordered += sorted((item for item in remaining if item[0] not in expired), key=_victim_key(policy))
+    for name, entry in ordered:
+        if total <= target:
+            break
+        victims[name] = "quota"
+        total -= entry.size
+    return victims
+
+# Delete evicted files and tombstone them (applied from the log on every node).
+# `files` maps each name to the version that was planned for eviction; a copy
+# rewritten since then is newer and kept. Older logs carry a plain list of names.
+def apply_evictions(files, evicted_at=None):
+    if not isinstance(files, dict):
+        files = dict.fromkeys(files)
+    removed = 0
+    for filename, version in files.items():
+        filename = os.path.basename(filename)
+        if version is not None and (cache_index.version(filename) or 0) > version:
+            print(f"[Cache] Keeping {filename}: rewritten after it was planned for eviction")
+            continue
+        if cache_store.remove_file(filename):
+            removed += 1
+        # Tombstone at the evicted version, so a newer crawl of the file still replicates
+        cache_index.tombstone(filename, version / 1000 if version else evicted_at)
+    with _pending_lock:
+        for filename in files:
+            _pending.pop(filename, None)
+    return removed
+
+# One eviction round; returns the files chosen
+def enforce_quota():
+    node = raft_instance.raft_node
+    if not SHARDING_ENABLED and node.state != NodeState.LEADER:
+        return {}
+    with _pending_lock:
+        pending = {name for name, at in _pending.items() if time.monotonic() - at < PENDING_TIMEOUT}
+    entries = {name: e for name, e in cache_index.entries().items() if name not in pending}
+    victims = plan_evictions(entries)
+    if not victims:
+        return {}
+
+    with span("cache.evict", files=len(victims)):
+        # Skip files rewritten while planning; the fresh copy is worth keeping
+        victims = {name: reason for name, reason in victims.items() if cache_index.version(name) == entries[name].version}
+        evicted_at = time.time()
+        if SHARDING_ENABLED:
+            apply_evictions({name: entries[name].version for name in victims}, evicted_at)
+        else:
+            command = {"type": "evict_files", "files": {name: entries[name].version for name in sorted(victims)}, "evicted_at": evicted_at}
+            trace = current_context()
+            if trace:
+                command["trace"] = trace
+            with _pending_lock:
+                _pending.update(dict.fromkeys(victims, time.monotonic()))
+            if not node.append_command(command):
+                with _pending_lock:
+                    for name in victims:
+                        _pending.pop(name, None)
+                return {}
+    for reason in victims.values():
+        CACHE_EVICTIONS.labels(reason).inc()
+    freed = sum(entries[name].size for name in victims)
+    print(f"[Cache] Evicting {len(victims)} files ({freed} bytes): {', '.join(sorted(victims))}")
+    return victims
+
+# Background eviction loop, started with the node
+def start_cache_manager(interval=CACHE_EVICTION_INTERVAL):
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                enforce_quota()
+            except Exception as e:
+                print(f"[Cache] Eviction round failed: {e}")
+    threading.Thread(target=run, daemon=True).start()
+
+# Index entries plus quota and policy, for /cache-stats
+def describe():
+    entries = cache_index.entries()
+    return {
+        "quota_bytes": CACHE_QUOTA_BYTES,
+        "policy": CACHE_EVICTION_POLICY,
+        "ttl_hours": CACHE_TTL_HOURS,
+        "total_bytes": sum(e.size for e in entries.values()),
+        "files": {
+            name: {"size": e.size, "mtime": e.mtime, "last_access": e.last_access, "hits": e.hits}
+            for name, e in sorted(entries.items())
+        },
+        "tombstones": cache_index.tombstones(),
+    }
@@ -0,0 +1,160 @@
+# cache_store.py
+# Cache file writes. Data goes to a temp file in CACHE_DIR that is renamed
+# over the live file, so readers see the old or the new contents, never a torn
+# file. Each file has a sidecar (<name>.meta) holding its version and sha256.
+# The version is the time the data was fetched from MarketCheck, in ms, and
+# travels with the data, so every copy of the same crawl has the same version
+# no matter when a replica wrote it.
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import cache_index
+import state
+
+SIDECAR_SUFFIX = ".meta"
+
+# Writes staged by the batch() active on this thread, if any
+_local = threading.local()
+
+def new_version():
+    return int(time.time() * 1000)
+
+def _path(filename):
+    return os.path.join(state.CACHE_DIR, os.path.basename(filename))
+
+def _tmp_path(filename):
+    return f"{_path(filename)}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def _write_tmp(path, data, sync):
+    with open(path, "wb") as f:
+        f.write(data)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# Version and hash of a cached file, or None if it has no sidecar
+def read_meta(filename):
+    try:
+        with open(_path(filename) + SIDECAR_SUFFIX) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+# Whether downloaded contents match the sha256 a peer reported for them
+def matches(data, meta):
+    return not meta.get("sha256") or hashlib.sha256(data).hexdigest() == meta["sha256"]
+
+# Path and meta of a file as this thread will leave it, counting a write staged
+# in the current batch
+def _current(filename):
+    filename = os.path.basename(filename)
+    staged = getattr(_local, "staged", None)
+    if staged and filename in staged:
+        _, path, _, meta = staged[filename]
+        return path, meta
+    return _path(filename), read_meta(filename)
+
+def has_version(filename, version):
+    path, meta = _current(filename)
+    return meta is not None and version is not None and meta.get("version") == version and os.path.exists(path)
+
+# Contents and meta of a cached file, or (None, None) if it is missing
+def read_file(filename):
+    path, meta = _current(filename)
+    if meta is None:
+        return None, None
+    try:
+        with open(path, "rb") as f:
+            return f.read(), meta
+    except FileNotFoundError:
+        return None, None
+
+# Stage the temp files for one write; returns what _commit needs to publish it
+def _stage(filename, data, version, sync):
+    filename = os.path.basename(filename)
+    meta = {"version": version or new_version(), "sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+    tmp = _tmp_path(filename)
+    meta_tmp = tmp + SIDECAR_SUFFIX
+    _write_tmp(tmp, data, sync)
+    _write_tmp(meta_tmp, json.dumps(meta).encode(), sync)
+    return filename, tmp, meta_tmp, meta
+
+# Rename staged temp files over the live ones and update the index. The file's
+# mtime is set to its version, so TTL checks (is_recent, eviction) age every
+# copy from when the data was fetched, not from when this node wrote it.
+def _commit(filename, tmp, meta_tmp, meta):
+    fetched_at = meta["version"] / 1000
+    os.utime(tmp, (fetched_at, fetched_at))
+    os.replace(tmp, _path(filename))
+    os.replace(meta_tmp, _path(filename) + SIDECAR_SUFFIX)
+    cache_index.record(filename, meta["version"])
+
+# Atomically replace a cache file. Inside batch() the fsync and rename are
+# deferred to the end of the batch.
+def write_file(filename, data, version=None):
+    staged = getattr(_local, "staged", None)
+    if staged is not None:
+        previous = staged.pop(os.path.basename(filename), None)
+        if previous:
+            _discard(previous)
+        entry = _stage(filename, data, version, sync=False)
+        staged[entry[0]] = entry
+        return entry[3]
+    entry = _stage(filename, data, version, sync=True)
+    _commit(*entry)
+    _fsync_path(state.CACHE_DIR)
+    return entry[3]
+
+def _discard(entry):
+    for path in entry[1:3]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+# Delete a cache file and its sidecar, including a write staged in this batch
+def remove_file(filename):
+    filename = os.path.basename(filename)
+    staged = getattr(_local, "staged", None)
+    if staged and filename in staged:
+        _discard(staged.pop(filename))
+    removed = False
+    for path in (_path(filename), _path(filename) + SIDECAR_SUFFIX):
+        try:
+            os.remove(path)
+            removed = True
+        except FileNotFoundError:
+            pass
+    cache_index.forget(filename)
+    return removed
+
+# Group the writes made on this thread: temp files are fsynced back to back at
+# the end, then renamed, then the directory is fsynced once. Used when many
+# replicated entries are applied in a burst.
+@contextmanager
+def batch():
+    if getattr(_local, "staged", None) is not None:
+        yield
+        return
+    _local.staged = {}
+    try:
+        yield
+    finally:
+        staged, _local.staged = _local.staged, None
+        for entry in staged.values():
+            _fsync_path(entry[1])
+            _fsync_path(entry[2])
+        for entry in staged.values():
+            _commit(*entry)
+        if staged:
+            _fsync_path(state.CACHE_DIR)
@@ -1,31 +1,83 @@
 import os
+import io
 import csv
+import contextvars
+import json
+import queue
+import threading
 import time
 import requests
 from datetime import datetime, timedelta
-from config import API_KEY, BASE_URL, HEADERS
-from state import CACHE_DIR, NODE_ID, CLUSTER_NODES
-from raft_instance import raft_node
+from config import API_KEY, BASE_URL, CACHE_TTL_HOURS, HEADERS, SHARDING_ENABLED
+import cache_delta
+import cache_index
+import cache_store
+import raft_instance
+import state
+from models import Listing, LISTING_FIELDS, listing_key
+from metrics import Counter, Gauge, Histogram
+from tracing import current_context, record, span
 
-os.makedirs(CACHE_DIR, exist_ok=True)
+MARKETCHECK_PAGE_SECONDS = Histogram("carbitrage_marketcheck_page_seconds", "Latency of one MarketCheck search page")
+MARKETCHECK_ERRORS = Counter("carbitrage_marketcheck_errors_total", "MarketCheck page requests that failed")
+CSV_PARSE_SECONDS = Histogram("carbitrage_csv_parse_seconds", "Time spent parsing one cached CSV file")
+CACHE_DIR_BYTES = Gauge("carbitrage_cache_dir_bytes", "Total size of the files in this node's cache directory")
+REFRESH_LOG_BYTES = Counter("carbitrage_refresh_log_bytes_total", "Listing data appended to the Raft log by refreshes", labels=("kind",))
+
+CACHE_DIR_BYTES.set_function(cache_index.total_bytes)
 
 # Check if cached file is recent
-def is_recent(file_path, hours=24):
+def is_recent(file_path, hours=CACHE_TTL_HOURS):
     if not os.path.exists(file_path):
         return False
     modified_time = datetime.fromtimestamp(os.path.getmtime(file_path))
     return datetime.now() - modified_time < timedelta(hours=hours)
 
+# Cache filename for a make/model/city combination
+def cache_filename(make, model_keyword, city):
+    return f"{make.lower()}_{model_keyword.lower()}_{city.lower()}.csv"
+
 # Fetch car listings from API
 def fetch_cars(country, city, make, model_keyword, max_cars=500, rows_per_request=50):
-    filename = f"{make.lower()}_{model_keyword.lower()}_{city.lower()}.csv"
-    filepath = os.path.join(CACHE_DIR, filename)
+    with span("fetch_cars", city=city, make=make, model=model_keyword):
+        return list(iter_cars(country, city, make, model_keyword, max_cars, rows_per_request))
+
+# Yield car listings from the cache, or page by page from the API as they arrive
+def iter_cars(country, city, make, model_keyword, max_cars=500, rows_per_request=50):
+    filename = cache_filename(make, model_keyword, city)
+    filepath = os.path.join(state.CACHE_DIR, filename)
 
     if is_recent(filepath):
         print(f"[Cache] Using cached data for {city} from '{filepath}'")
-        return load_from_csv(filepath)
+        yield from iter_csv(filepath)
+        return
+
+    # The crawl runs on its own thread (in the caller's trace) and is saved and
+    # replicated even if the caller stops reading, e.g. when a /client/stream
+    # client disconnects mid-crawl
+    pages = queue.Queue()
+    context = contextvars.copy_context()
+    threading.Thread(
+        target=context.run,
+        args=(_run_crawl, pages, country, city, make, model_keyword, max_cars, rows_per_request, filename, filepath),
+        daemon=True,
+    ).start()
+    while (page := pages.get()) is not None:
+        yield from page
+
+def _run_crawl(pages, *args):
+    try:
+        for page in _crawl(*args):
+            pages.put(page)
+    except Exception as e:
+        print(f"[Fetch Error] Crawl failed: {e}")
+    finally:
+        pages.put(None)
 
+# Page through the API, yielding each page's listings, then save and replicate the result
+def _crawl(country, city, make, model_keyword, max_cars, rows_per_request, filename, filepath):
     cars = []
+    seen = set()
     start = 0
     params = {
         "api_key": API_KEY,
@@ -37,10 +89,14 @@ def fetch_cars(country, city, make, model_keyword, max_cars=500, rows_per_reques
 
     while start < max_cars:
         params["start"] = start
+        page_cars = []
+        page_start = time.perf_counter()
         try:
-            res = requests.get(BASE_URL, headers=HEADERS, params=params)
-            res.raise_for_status()
-            data = res.json()
+            with span("marketcheck.page", start=start):
+                res = requests.get(BASE_URL, headers=HEADERS, params=params)
+                res.raise_for_status()
+                data = res.json()
+            MARKETCHECK_PAGE_SECONDS.observe(time.perf_counter() - page_start)
             listings = data.get("listings", [])
             if not listings:
                 break
@@ -54,75 +110,136 @@ def fetch_cars(country, city, make, model_keyword, max_cars=500, rows_per_reques
 
                 if model and model_keyword.lower().replace("-", "") in model.lower().replace("-", ""):
                     if mileage is not None and mileage > 6213:
-                        cars.append({
-                            "year": build.get("year"),
-                            "make": build.get("make"),
-                            "model": model,
-                            "price": price,
-                            "mileage": mileage,
-                            "location": f"{dealer.get('city')}, {dealer.get('state')}"
-                        })
+                        location = f"{dealer.get('city')}, {dealer.get('state')}"
+                        listing_id = listing.get("id") or listing.get("vin")
+                        if listing_id is None:
+                            # Identical cars at one dealer get numbered copies of the same key
+                            key = listing_key(build.get("year"), build.get("make"), model, mileage, location)
+                            listing_id, n = key, 1
+                            while listing_id in seen:
+                                listing_id, n = f"{key}-{n}", n + 1
+                        elif listing_id in seen:
+                            # Listed again on a later page after the results shifted
+                            continue
+                        seen.add(listing_id)
+                        page_cars.append(Listing.create(
+                            year=build.get("year"),
+                            make=build.get("make"),
+                            model=model,
+                            price=price,
+                            mileage=mileage,
+                            location=location,
+                            id=str(listing_id)
+                        ))
 
             start += rows_per_request
-            time.sleep(0.2)
         except Exception as e:
+            MARKETCHECK_ERRORS.inc()
             print(f"[Fetch Error] {e}")
             break
 
-    save_to_csv(cars, filepath)
-    replicate_to_followers(filepath, filename)
-    return cars
+        # Hand each page to the caller before requesting the next one
+        cars.extend(page_cars)
+        yield page_cars
+        time.sleep(0.2)
 
-# Replicate file to follower nodes
-def replicate_to_followers(filepath, filename):
+    with span("save_to_csv", file=filename, rows=len(cars)):
+        _, delta = cache_delta.save_refresh(filepath, encode_csv(cars))
+    with span("replicate_to_followers", file=filename, delta=delta is not None):
+        replicate_to_followers(filepath, filename, delta)
+
+# Replicate file to follower nodes, as a delta against the previous version
+# when the refresh produced one
+def replicate_to_followers(filepath, filename, delta=None):
+    if SHARDING_ENABLED:
+        # Only the key's owners keep a copy, so skip the cluster-wide Raft log
+        from sharding import push_to_owners
+        push_to_owners(filepath, filename)
+        return
     try:
-        with open(filepath, "rb") as f:
-            file_data = f.read()
-        
-        # Use RAFT to replicate the file
-        raft_node.append_command({
-            "type": "replicate_file",
-            "filename": filename,
-            "data": file_data.decode()
-        })
+        if delta is not None:
+            command = {"type": "replicate_delta", "filename": filename, **delta}
+            REFRESH_LOG_BYTES.labels("delta").inc(len(json.dumps(delta)))
+        else:
+            with open(filepath, "rb") as f:
+                file_data = f.read()
+            meta = cache_store.read_meta(filename) or {}
+            command = {
+                "type": "replicate_file",
+                "filename": filename,
+                "data": file_data.decode(),
+                "version": meta.get("version"),
+            }
+            REFRESH_LOG_BYTES.labels("full").inc(len(file_data))
+
+        # Use RAFT to replicate the file, carrying the trace so followers can join it
+        trace = current_context()
+        if trace:
+            command["trace"] = trace
+        raft_instance.raft_node.append_command(command)
         
     except Exception as e:
         print(f"[Replication Error] Failed to replicate file '{filename}': {e}")
 
 # Sync all files to new node
-def replicate_all_to_new_node(new_node_port):
-    for fname in os.listdir(CACHE_DIR):
-        fpath = os.path.join(CACHE_DIR, fname)
-        if not os.path.isfile(fpath):
-            continue
+def replicate_all_to_new_node(new_node_id):
+    new_node_url = raft_instance.raft_node.peer_url(new_node_id)
+    for fname in cache_index.files():
+        fpath = os.path.join(state.CACHE_DIR, fname)
+        if SHARDING_ENABLED:
+            from sharding import is_owner
+            if not is_owner(fname, new_node_id):
+                continue
         try:
             with open(fpath, "rb") as f:
                 res = requests.post(
-                    f"http://localhost:{new_node_port}/replicate",
+                    f"{new_node_url}/replicate",
                     files={"file": (fname, f.read())},
-                    data={"filename": fname},
+                    data={"filename": fname, "version": cache_index.version(fname)},
                     timeout=5
                 )
                 if res.status_code == 200:
-                    print(f"[Sync] Sent '{fname}' to new node on port {new_node_port}")
+                    print(f"[Sync] Sent '{fname}' to new Node {new_node_id}")
         except Exception as e:
-            print(f"[Sync Error] Sending '{fname}' to port {new_node_port}: {e}")
+            print(f"[Sync Error] Sending '{fname}' to Node {new_node_id}: {e}")
 
-# Save cars to CSV
+# Cars as CSV bytes
+def encode_csv(cars):
+    buffer = io.StringIO(newline='')
+    writer = csv.writer(buffer)
+    writer.writerow(LISTING_FIELDS)
+    writer.writerows(car.as_row() for car in cars)
+    return buffer.getvalue().encode()
+
+# Save cars to CSV (atomically, stamped with a new version)
 def save_to_csv(cars, filename):
-    with open(filename, mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=["year", "make", "model", "price", "mileage", "location"])
-        writer.writeheader()
-        writer.writerows(cars)
+    return cache_store.write_file(filename, encode_csv(cars))
 
 # Load cars from CSV
 def load_from_csv(filename):
-    cars = []
+    return list(iter_csv(filename))
+
+# Lazily parse cars from CSV one row at a time
+def iter_csv(filename):
+    # Parse time excludes the time the caller spends between rows
+    parse_time = 0.0
+    start = time.perf_counter()
+    cache_index.touch(filename)
     with open(filename, mode='r', newline='') as file:
         reader = csv.DictReader(file)
         for row in reader:
-            row["year"] = int(row["year"]) if row["year"] else None
-            row["price"] = float(row["price"]) if row["price"] else 0
-            row["mileage"] = float(row["mileage"]) if row["mileage"] else 0
-            cars.append(row)
-    return cars
+            car = Listing.create(
+                year=int(row["year"]) if row["year"] else None,
+                make=row["make"],
+                model=row["model"],
+                price=float(row["price"]) if row["price"] else 0,
+                mileage=float(row["mileage"]) if row["mileage"] else 0,
+                location=row["location"],
+                id=row.get("id") or ""
+            )
+            parse_time += time.perf_counter() - start
+            yield car
+            start = time.perf_counter()
+    parse_time += time.perf_counter() - start
+    CSV_PARSE_SECONDS.observe(parse_time)
+    record("load_from_csv", parse_time, file=os.path.basename(filename))
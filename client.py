@@ -1,53 +1,28 @@
-import requests
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cluster_client import ClusterClient
 from models import ClientRequest
 
-# Node configuration
-CLUSTER_NODES = {
-    217: 8217,
-    536: 8536,
-    657: 8657,
-    777: 8777,
-    888: 8888
-}
+# Shared connection to the cluster; the leader is cached between searches
+CLIENT = ClusterClient()
 
 # Verify single leader exists
 def verify_unique_leader():
-    confirmed_leaders = set()
-    for node_id, port in CLUSTER_NODES.items():
-        try:
-            res = requests.get(f"http://localhost:{port}/leader", timeout=2)
-            data = res.json()
-            leader_id = data.get("leader_id")
-            if leader_id is not None:
-                confirmed_leaders.add(leader_id)
-        except:
-            continue
-    if len(confirmed_leaders) == 1:
-        return list(confirmed_leaders)[0]
-    print(f"[Client] Conflicting leader reports: {confirmed_leaders}")
-    return None
+    return CLIENT.verify_unique_leader()
 
 # Find active leader node
-def discover_current_leader():
-    for node_id, port in CLUSTER_NODES.items():
-        try:
-            res = requests.get(f"http://localhost:{port}/leader", timeout=2)
-            data = res.json()
-            leader_id = data.get("leader_id")
-            if leader_id is not None:
-                leader_port = CLUSTER_NODES.get(leader_id)
-                if leader_port:
-                    health = requests.get(f"http://localhost:{leader_port}/health", timeout=2)
-                    if health.status_code == 200:
-                        print(f"[Client] Communicating with leader node {leader_id} on port {leader_port}.")
-                        return leader_id, leader_port
-        except Exception as e:
-            print(f"[Debug] Could not reach node on port {port}: {e}")
-    print("[Client] No leader found.")
-    return None, None
+def discover_current_leader(force=False):
+    leader_id, leader_address = CLIENT.discover(force)
+    if leader_id is None:
+        print("[Client] No leader found.")
+    else:
+        print(f"[Client] Communicating with leader node {leader_id} at {leader_address}.")
+    return leader_id, leader_address
 
 # Compare cheapest cars between cities
-def run_cheapest_lookup(leader_port):
+def run_cheapest_lookup():
     country = input("Enter country (e.g., CA): ").strip()
     city1 = input("Enter first city: ").strip()
     city2 = input("Enter second city: ").strip()
@@ -63,8 +38,7 @@ def run_cheapest_lookup(leader_port):
     }
 
     try:
-        res = requests.post(f"http://localhost:{leader_port}/client", json=payload, timeout=5)
-        data = res.json()
+        data = CLIENT.post("/client", payload, timeout=30)
 
         if "error" in data:
             print(f"[Client] Error: {data['error']}. Leader is Node {data['leader_id']}")
@@ -89,7 +63,7 @@ def run_cheapest_lookup(leader_port):
         print(f"[Client] Failed to contact leader: {e}")
 
 # Compare price per km between cities
-def run_arbitrage_lookup(leader_port):
+def run_arbitrage_lookup():
     country = input("Enter country (e.g., CA): ").strip()
     city1 = input("Enter first city: ").strip()
     city2 = input("Enter second city: ").strip()
@@ -105,8 +79,7 @@ def run_arbitrage_lookup(leader_port):
     }
 
     try:
-        res = requests.post(f"http://localhost:{leader_port}/client", json=payload, timeout=5)
-        data = res.json()
+        data = CLIENT.post("/client", payload, timeout=30)
 
         if "error" in data:
             print(f"[Client] Error: {data['error']}. Leader is Node {data['leader_id']}")
@@ -133,22 +106,167 @@ def run_arbitrage_lookup(leader_port):
     except Exception as e:
         print(f"[Client] Failed to contact leader: {e}")
 
+# Read NDJSON events from the leader as they are produced
+def stream_client_results(payload):
+    with CLIENT.request("POST", "/client/stream", json=payload, stream=True, timeout=(5, 60)) as res:
+        if res.headers.get("content-type", "").startswith("application/json"):
+            yield {"type": "error", **res.json()}
+            return
+        for line in res.iter_lines():
+            if line:
+                yield json.loads(line)
+
+# Show listings for both cities while the leader is still fetching them
+def run_streaming_lookup():
+    country = input("Enter country (e.g., CA): ").strip()
+    city1 = input("Enter first city: ").strip()
+    city2 = input("Enter second city: ").strip()
+    make = input("Enter car make (e.g., Toyota): ").strip()
+    model = input("Enter car model (e.g., Corolla): ").strip()
+
+    payload = {
+        "country": country,
+        "city1": city1,
+        "city2": city2,
+        "make": make,
+        "model": model
+    }
+
+    cheapest = {}
+    try:
+        for event in stream_client_results(payload):
+            kind = event.get("type")
+            if kind == "error":
+                print(f"[Client] Error: {event.get('error')}. Leader is Node {event.get('leader_id')}")
+                return
+            elif kind == "meta":
+                print(f"[Client] Streaming listings from leader Node {event['leader_id']}:")
+            elif kind == "listing":
+                city, car = event["city"], event["car"]
+                print(f"  {city}: ${car.get('price')} - {car.get('year')} {car.get('make')} {car.get('model')} ({car.get('mileage')} km)")
+                price = car.get("price")
+                if isinstance(price, (int, float)) and price > 0:
+                    if city not in cheapest or price < cheapest[city]:
+                        cheapest[city] = price
+            elif kind == "city_done":
+                print(f"[Client] {event['city']}: {event['count']} listings")
+
+        if len(cheapest) == 2:
+            better_city = min(cheapest, key=cheapest.get)
+            print(f"[Client] Recommended purchase location: {better_city}")
+    except Exception as e:
+        print(f"[Client] Failed to contact leader: {e}")
+
+# Cheapest price and best price per km in each city, plus the city to buy in
+def summarize_results(results):
+    prices, ratios = {}, {}
+    for city, cars in results.items():
+        if isinstance(cars, dict):
+            cars = [cars]
+        if not isinstance(cars, list):
+            continue
+        for car in cars:
+            try:
+                price = float(car["price"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if price <= 0:
+                continue
+            prices[city] = min(price, prices.get(city, price))
+            try:
+                mileage = float(car["mileage"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if mileage > 0:
+                ratios[city] = min(price / mileage, ratios.get(city, price / mileage))
+    return {
+        "prices": prices,
+        "price_per_km": ratios,
+        "cheapest_city": min(prices, key=prices.get) if len(prices) == 2 else None,
+        "arbitrage_city": min(ratios, key=ratios.get) if len(ratios) == 2 else None,
+    }
+
+# Run one batch query through the shared client
+def run_batch_query(client, query, timeout):
+    payload = {k: query[k] for k in ClientRequest.model_fields if k in query}
+    record = {"id": query.get("id"), "query": payload}
+    start = time.perf_counter()
+    try:
+        data = client.post("/client", payload, timeout=timeout)
+        if "error" in data:
+            record["error"] = data["error"]
+        else:
+            record["leader_id"] = data["leader_id"]
+            record["results"] = data["results"]
+            record.update(summarize_results(data["results"]))
+    except Exception as e:
+        record["error"] = str(e)
+    record["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return record
+
+# Read ClientRequest-shaped queries from a JSONL file, skipping blank lines
+def load_queries(path):
+    queries = []
+    with open(path) as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            query = json.loads(line)
+            missing = [k for k in ClientRequest.model_fields if k not in query]
+            if missing:
+                print(f"[Client] Skipping line {lineno}: missing {', '.join(missing)}")
+                continue
+            query.setdefault("id", lineno)
+            queries.append(query)
+    return queries
+
+# Replay a JSONL file of queries concurrently and write one result per line
+def run_batch(path, out_path, concurrency=8, timeout=30):
+    queries = load_queries(path)
+    latencies, failures = [], 0
+    start = time.perf_counter()
+    with open(out_path, "w") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in pool.map(lambda q: run_batch_query(CLIENT, q, timeout), queries):
+            out.write(json.dumps(record) + "\n")
+            if "error" in record:
+                failures += 1
+            else:
+                latencies.append(record["latency_ms"])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0
+    print(f"[Client] {len(queries)} queries in {elapsed:.2f}s, {failures} failed, p50 {p50:.1f}ms, p99 {p99:.1f}ms -> {out_path}")
+
 # Main client loop
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", metavar="QUERIES_JSONL", help="run queries from a JSONL file instead of prompting")
+    parser.add_argument("--out", default="batch_results.jsonl", help="JSONL file for batch results")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+    if args.batch:
+        run_batch(args.batch, args.out, args.concurrency, args.timeout)
+        return
+
     while True:
-        leader_id, leader_port = discover_current_leader()
+        leader_id, leader_address = discover_current_leader()
         if not leader_id:
             break
 
         print("\nChoose an option:")
         print("1. Cheapest vehicle comparison")
         print("2. Best arbitrage deal (price per km)")
-        choice = input("Enter 1 or 2: ").strip()
+        print("3. Stream all listings as they are fetched")
+        choice = input("Enter 1, 2 or 3: ").strip()
 
         if choice == '1':
-            run_cheapest_lookup(leader_port)
+            run_cheapest_lookup()
         elif choice == '2':
-            run_arbitrage_lookup(leader_port)
+            run_arbitrage_lookup()
+        elif choice == '3':
+            run_streaming_lookup()
         else:
             print("Invalid choice.")
 
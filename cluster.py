@@ -0,0 +1,69 @@
+# cluster.py
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Optional
+
+# Cluster membership as carried in the Raft log. During a joint-consensus
+# change old_voters holds C_old and voters holds C_new; decisions then need
+# a majority of both. Learners receive entries but never vote.
+@dataclass(frozen=True)
+class ClusterConfig:
+    voters: FrozenSet[int]
+    old_voters: Optional[FrozenSet[int]] = None
+    learners: FrozenSet[int] = frozenset()
+    addresses: Dict[int, str] = field(default_factory=dict)
+
+    @classmethod
+    def bootstrap(cls, nodes: Dict[int, str]) -> "ClusterConfig":
+        return cls(voters=frozenset(nodes), addresses=dict(nodes))
+
+    def is_joint(self) -> bool:
+        return self.old_voters is not None
+
+    def all_voters(self) -> FrozenSet[int]:
+        return self.voters | (self.old_voters or frozenset())
+
+    def members(self) -> FrozenSet[int]:
+        return self.all_voters() | self.learners
+
+    def is_voter(self, node_id: int) -> bool:
+        return node_id in self.all_voters()
+
+    def has_quorum(self, node_ids) -> bool:
+        """True if node_ids hold a majority of C_new (and of C_old while joint)"""
+        node_ids = set(node_ids)
+        def majority(group):
+            return len(node_ids & group) > len(group) // 2
+        if not majority(self.voters):
+            return False
+        return self.old_voters is None or majority(self.old_voters)
+
+    def url(self, node_id: int) -> str:
+        return f"http://{self.addresses[node_id]}"
+
+    def to_command(self) -> dict:
+        return {
+            "type": "config",
+            "voters": sorted(self.voters),
+            "old_voters": sorted(self.old_voters) if self.old_voters is not None else None,
+            "learners": sorted(self.learners),
+            "addresses": {str(nid): addr for nid, addr in self.addresses.items()},
+        }
+
+    @classmethod
+    def from_command(cls, command: dict) -> "ClusterConfig":
+        old_voters = command.get("old_voters")
+        return cls(
+            voters=frozenset(int(n) for n in command["voters"]),
+            old_voters=frozenset(int(n) for n in old_voters) if old_voters is not None else None,
+            learners=frozenset(int(n) for n in command.get("learners", [])),
+            addresses={int(nid): addr for nid, addr in command.get("addresses", {}).items()},
+        )
+
+    def describe(self) -> dict:
+        return {
+            "voters": sorted(self.voters),
+            "old_voters": sorted(self.old_voters) if self.old_voters is not None else None,
+            "learners": sorted(self.learners),
+            "joint": self.is_joint(),
+            "addresses": {str(nid): addr for nid, addr in sorted(self.addresses.items())},
+        }
@@ -0,0 +1,165 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+import requests
+from requests.adapters import HTTPAdapter
+from config import CLUSTER_NODES
+
+# How long a discovered leader is trusted before the cluster is probed again
+LEADER_TTL = 5.0
+PROBE_TIMEOUT = 1.0
+
+# Raised when no node names a reachable leader
+class NoLeaderError(Exception):
+    pass
+
+# Talks to whichever node currently leads the cluster. Nodes are probed in
+# parallel, the answer is cached for LEADER_TTL seconds, and requests that
+# land on a follower are retried against the leader it names. One pooled
+# session is shared by every call, so connections are reused.
+class ClusterClient:
+    def __init__(self, nodes=None, leader_ttl=LEADER_TTL, probe_timeout=PROBE_TIMEOUT, max_attempts=3, pool_size=32):
+        self.nodes = dict(nodes or CLUSTER_NODES)
+        self.leader_ttl = leader_ttl
+        self.probe_timeout = probe_timeout
+        self.max_attempts = max_attempts
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="cluster-probe")
+        self.lock = threading.Lock()
+        self.leader_id = None
+        self.leader_address = None
+        self.leader_expires = 0.0
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Replace known members with a node's /cluster view
+    def refresh_membership(self, address):
+        try:
+            res = self.session.get(f"http://{address}/cluster", timeout=self.probe_timeout)
+            addresses = res.json().get("addresses", {})
+            if addresses:
+                self.nodes = {int(nid): addr for nid, addr in addresses.items()}
+        except Exception as e:
+            print(f"[Client] Could not refresh membership from {address}: {e}")
+
+    def _probe(self, node_id, address):
+        res = self.session.get(f"http://{address}/leader", timeout=self.probe_timeout)
+        return node_id, address, res.json().get("leader_id")
+
+    # Ask every node for its leader at once. A node that names itself answers
+    # immediately; otherwise the most reported leader is health-checked.
+    def _find_leader(self):
+        futures = [self.executor.submit(self._probe, nid, addr) for nid, addr in list(self.nodes.items())]
+        reports = {}
+        try:
+            for future in as_completed(futures, timeout=self.probe_timeout + 0.5):
+                try:
+                    node_id, address, leader_id = future.result()
+                except Exception:
+                    continue
+                if leader_id is None:
+                    continue
+                if leader_id == node_id:
+                    return leader_id, address
+                reports.setdefault(leader_id, address)
+        except TimeoutError:
+            pass
+        for leader_id, reporter in reports.items():
+            if leader_id not in self.nodes:
+                self.refresh_membership(reporter)
+            address = self.nodes.get(leader_id)
+            if address and self._healthy(address):
+                return leader_id, address
+        return None, None
+
+    def _healthy(self, address):
+        try:
+            return self.session.get(f"http://{address}/health", timeout=self.probe_timeout).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    # Cached leader, probing the cluster when the cache is empty or stale
+    def discover(self, force=False):
+        with self.lock:
+            if not force and self.leader_address and time.monotonic() < self.leader_expires:
+                return self.leader_id, self.leader_address
+            leader_id, address = self._find_leader()
+            if address is None:
+                self._forget()
+                return None, None
+            self._remember(leader_id, address)
+        self.refresh_membership(address)
+        return leader_id, address
+
+    def _remember(self, leader_id, address):
+        self.leader_id, self.leader_address = leader_id, address
+        self.leader_expires = time.monotonic() + self.leader_ttl
+
+    def _forget(self):
+        self.leader_id, self.leader_address, self.leader_expires = None, None, 0.0
+
+    def invalidate(self, stale_address=None):
+        with self.lock:
+            if stale_address is None or self.leader_address == stale_address:
+                self._forget()
+
+    # Switch to the leader a follower named, if it is a known member
+    def _follow_hint(self, stale_address, leader_id):
+        with self.lock:
+            if self.leader_address != stale_address:
+                return
+            if leader_id in self.nodes:
+                self._remember(leader_id, self.nodes[leader_id])
+            else:
+                self._forget()
+
+    # Every node's reported leader, or None if they disagree
+    def verify_unique_leader(self):
+        futures = [self.executor.submit(self._probe, nid, addr) for nid, addr in list(self.nodes.items())]
+        done, _ = wait(futures, timeout=self.probe_timeout + 0.5)
+        leaders = {f.result()[2] for f in done if f.exception() is None and f.result()[2] is not None}
+        if len(leaders) == 1:
+            return leaders.pop()
+        print(f"[Client] Conflicting leader reports: {leaders}")
+        return None
+
+    # Send a request to the leader, following "not the leader" hints and
+    # re-probing after connection failures. Returns the requests.Response.
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", 30)
+        last_error = None
+        for _ in range(self.max_attempts):
+            _, address = self.discover()
+            if address is None:
+                raise NoLeaderError("No leader found")
+            try:
+                res = self.session.request(method, f"http://{address}{path}", **kwargs)
+            except requests.exceptions.RequestException as e:
+                last_error = e
+                self.invalidate(address)
+                continue
+            if res.headers.get("content-type", "").startswith("application/json"):
+                data = res.json()
+                if isinstance(data, dict) and "error" in data and "leader_id" in data and "not the leader" in str(data["error"]):
+                    res.close()
+                    last_error = NoLeaderError(f"{data['error']} (leader is {data['leader_id']})")
+                    self._follow_hint(address, data["leader_id"])
+                    continue
+            return res
+        raise last_error or NoLeaderError("No leader found")
+
+    def post(self, path, payload, **kwargs):
+        return self.request("POST", path, json=payload, **kwargs).json()
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs).json()
@@ -1,18 +1,40 @@
 # config.py
+import os
+from urllib.parse import urlparse
 
-# API configuration
-API_KEY = "xxxxxxxxxxxxxx"
-BASE_URL = "https://mc-api.marketcheck.com/v2/search/car/active"
-HEADERS = {"Host": "mc-api.marketcheck.com"}
+# API configuration (overridable from the environment, e.g. to point at a stub)
+API_KEY = os.environ.get("MARKETCHECK_API_KEY", "xxxxxxxxxxxxxx")
+BASE_URL = os.environ.get("MARKETCHECK_BASE_URL", "https://mc-api.marketcheck.com/v2/search/car/active")
+HEADERS = {"Host": urlparse(BASE_URL).netloc}
 
 # Node registry file
 NODE_REGISTRY = "active_nodes.txt"
 
-# Node ID to port mapping
+# Bootstrap cluster: node ID to host:port. Nodes can be added or removed at
+# runtime through /cluster/add and /cluster/remove on the leader.
 CLUSTER_NODES = {
-    217: 8217,
-    536: 8536,
-    657: 8657,
-    777: 8777,
-    888: 8888,
+    217: "localhost:8217",
+    536: "localhost:8536",
+    657: "localhost:8657",
+    777: "localhost:8777",
+    888: "localhost:8888",
 }
+
+# CARBITRAGE_CLUSTER="101=localhost:9101,102=localhost:9102" replaces the bootstrap cluster
+if os.environ.get("CARBITRAGE_CLUSTER"):
+    CLUSTER_NODES = {
+        int(nid): address
+        for nid, address in (item.split("=", 1) for item in os.environ["CARBITRAGE_CLUSTER"].split(","))
+    }
+
+# Consistent-hash sharding of the listing cache (off: every node caches every file)
+SHARDING_ENABLED = False
+REPLICATION_FACTOR = 3
+VIRTUAL_NODES = 64
+
+# Cache eviction: per-node quota for CACHE_DIR, how files are chosen once over
+# it ("lru" or "lfu"), and how long a cached file stays fresh
+CACHE_QUOTA_BYTES = int(float(os.environ.get("CARBITRAGE_CACHE_QUOTA_MB", "512")) * 1024 * 1024)
+CACHE_EVICTION_POLICY = os.environ.get("CARBITRAGE_CACHE_EVICTION", "lru")
+CACHE_TTL_HOURS = 24
+CACHE_EVICTION_INTERVAL = float(os.environ.get("CARBITRAGE_CACHE_EVICTION_INTERVAL", "30"))  # seconds between rounds
@@ -1,14 +1,23 @@
 import os
 import threading
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import time
 import requests
 
-from state import NODE_PORT, NODE_ID, CACHE_DIR
-from config import NODE_REGISTRY, CLUSTER_NODES
-from raft_instance import raft_node
-from routes import router
+import state
+from config import NODE_REGISTRY, SHARDING_ENABLED
+import raft_instance
+import cache_index
+import cache_store
+from arbitrage import start_scanner
+from cache_manager import start_cache_manager
+from price_history import start_history
+from routes import readiness, router
+from serialization import FastJSONResponse
+from sharding import is_owner
+from tracing import PARENT_HEADER, TRACE_HEADER, span
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Request
 from datetime import datetime
@@ -16,8 +25,35 @@ from datetime import datetime
 # Track first-node startup
 FIRST_NODE_STARTUP = False
 
+# Work done after the server starts listening: index the cache, start cache
+# eviction, the arbitrage scanner, price history and the shard rebalancer, and
+# log when the node first becomes ready
+def finish_startup(node):
+    count = cache_index.build()
+    print(f"[Startup] Indexed {count} cached files in {state.CACHE_DIR}")
+    start_cache_manager()
+    start_scanner()
+    start_history()
+    if SHARDING_ENABLED:
+        from sharding import start_rebalancer
+        start_rebalancer()
+    while not node.stopped.is_set() and not readiness()[0]:
+        time.sleep(0.05)
+
+# Node lifecycle: nothing runs until the app starts, and Raft stops with it
+@asynccontextmanager
+async def lifespan(app):
+    state.configure()
+    os.makedirs(state.CACHE_DIR, exist_ok=True)
+    node = raft_instance.init_raft_node()
+    node.start()
+    threading.Thread(target=finish_startup, args=(node,), daemon=True).start()
+    yield
+    print(f"[Shutdown] Stopping Node {state.NODE_ID}")
+    node.stop()
+
 # Initialize FastAPI app
-app = FastAPI(title="Distributed Car Arbitrage Node")
+app = FastAPI(title="Distributed Car Arbitrage Node", default_response_class=FastJSONResponse, lifespan=lifespan)
 
 # Add CORS support
 app.add_middleware(
@@ -31,49 +67,57 @@ app.add_middleware(
 # Include routes
 app.include_router(router)
 
-# Ensure cache dir exists
-os.makedirs(CACHE_DIR, exist_ok=True)
+# Chatty endpoints that are only traced when the caller is already tracing
+UNTRACED_PATHS = {"/health", "/leader", "/metrics", "/membership", "/raft/append_entries", "/raft/request_vote"}
 
-# Initialize node in registry
-raft_node.update_node_registry(NODE_ID, True, False)
+# Open a span per request, continuing a trace started by the caller if any
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    trace_id = request.headers.get(TRACE_HEADER)
+    path = request.url.path
+    if trace_id is None and (path in UNTRACED_PATHS or path.startswith("/debug/")):
+        return await call_next(request)
+    with span(f"{request.method} {path}", trace_id=trace_id, parent_id=request.headers.get(PARENT_HEADER), node=state.NODE_ID) as s:
+        response = await call_next(request)
+        s.attributes["status"] = response.status_code
+    response.headers[TRACE_HEADER] = s.trace_id
+    return response
 
 @app.post("/reconcile")
 async def reconcile():
     # Leader reconciliation with replicas
-    print(f"[Reconcile] Leader {NODE_ID} initiating reconciliation with replicas...")
-    for nid, port in CLUSTER_NODES.items():
-        if nid == NODE_ID:
+    print(f"[Reconcile] Leader {state.NODE_ID} initiating reconciliation with replicas...")
+    for nid in raft_instance.raft_node.config.members():
+        if nid == state.NODE_ID:
             continue
-        try:
-            health = requests.get(f"http://localhost:{port}/health", timeout=2)
-            if health.status_code != 200:
-                print(f"[Reconcile Skipped] Node {nid} is not healthy.")
-                continue
-        except requests.exceptions.RequestException:
+        base_url = raft_instance.raft_node.peer_url(nid)
+        if raft_instance.raft_node.membership.status(nid) == "dead":
             print(f"[Reconcile Skipped] Node {nid} is offline.")
             continue
 
         try:
-            res = requests.get(f"http://localhost:{port}/list-cache", timeout=5)
+            res = requests.get(f"{base_url}/list-cache", timeout=5)
             if res.status_code != 200:
                 print(f"[Reconcile] Could not list files on Node {nid}.")
                 continue
 
             their_files = res.json().get("files", [])
             for filename in their_files:
+                if SHARDING_ENABLED and not is_owner(filename):
+                    continue
                 try:
-                    meta = requests.get(f"http://localhost:{port}/cache-meta", params={"filename": filename}, timeout=5)
+                    meta = requests.get(f"{base_url}/cache-meta", params={"filename": filename}, timeout=5)
                     if meta.status_code != 200:
                         continue
                     replica_data = meta.json()
-                    replica_mtime = replica_data.get("mtime", 0)
-                    local_path = os.path.join(CACHE_DIR, filename)
-                    leader_mtime = os.path.getmtime(local_path) if os.path.exists(local_path) else 0
-                    if replica_mtime > leader_mtime or not os.path.exists(local_path):
-                        file_res = requests.get(f"http://localhost:{port}/get-cache-file", params={"filename": filename}, timeout=10)
-                        if file_res.status_code == 200:
-                            with open(local_path, "wb") as f:
-                                f.write(file_res.content)
+                    replica_version = replica_data.get("version") or 0
+                    if cache_index.is_tombstoned(filename, replica_version):
+                        continue
+                    leader_version = cache_index.version(filename)
+                    if leader_version is None or replica_version > leader_version:
+                        file_res = requests.get(f"{base_url}/get-cache-file", params={"filename": filename}, timeout=10)
+                        if file_res.status_code == 200 and cache_store.matches(file_res.content, replica_data):
+                            cache_store.write_file(filename, file_res.content, replica_version or None)
                             print(f"[Reconcile] Pulled {filename} from Node {nid}")
                         else:
                             print(f"[Reconcile] Failed to pull {filename} from Node {nid}")
@@ -87,23 +131,25 @@ def sync_cache_from_leader():
     # Sync cache from leader node
     from state import get_leader
     leader_id = get_leader()
-    if leader_id is None or leader_id == NODE_ID:
+    if leader_id is None or leader_id == state.NODE_ID:
         global FIRST_NODE_STARTUP
         FIRST_NODE_STARTUP = True
         return
-    leader_port = CLUSTER_NODES[leader_id]
+    leader_url = raft_instance.raft_node.peer_url(leader_id)
     print(f"[Sync] Attempting to sync cache from Leader Node {leader_id}...")
     try:
-        res = requests.get(f"http://localhost:{leader_port}/list-cache", timeout=5)
+        res = requests.get(f"{leader_url}/list-cache", timeout=5)
         files = res.json().get("files", [])
         for filename in files:
-            local_path = os.path.join(CACHE_DIR, filename)
-            if os.path.exists(local_path):
+            if SHARDING_ENABLED and not is_owner(filename):
+                continue
+            local_path = os.path.join(state.CACHE_DIR, filename)
+            if os.path.exists(local_path) or cache_index.is_tombstoned(filename):
                 continue
-            file_res = requests.get(f"http://localhost:{leader_port}/get-cache-file", params={"filename": filename}, timeout=10)
-            if file_res.status_code == 200:
-                with open(local_path, "wb") as f:
-                    f.write(file_res.content)
+            meta = requests.get(f"{leader_url}/cache-meta", params={"filename": filename}, timeout=5).json()
+            file_res = requests.get(f"{leader_url}/get-cache-file", params={"filename": filename}, timeout=10)
+            if file_res.status_code == 200 and cache_store.matches(file_res.content, meta):
+                cache_store.write_file(filename, file_res.content, meta.get("version"))
                 print(f"[Sync] Downloaded {filename} from leader")
     except requests.exceptions.ConnectionError:
         print("[Sync Warning] Leader is unreachable. Skipping cache sync.")
@@ -114,11 +160,11 @@ def attempt_leader_reconciliation():
     # Trigger reconciliation if this node is leader
     from state import get_leader
     current_leader = get_leader()
-    if current_leader != NODE_ID:
+    if current_leader != state.NODE_ID:
         return
-    print(f"[Reconcile Trigger] Node {NODE_ID} is confirmed leader. Triggering reconciliation...")
+    print(f"[Reconcile Trigger] Node {state.NODE_ID} is confirmed leader. Triggering reconciliation...")
     try:
-        requests.post(f"http://localhost:{NODE_PORT}/reconcile", timeout=10)
+        requests.post(f"{raft_instance.raft_node.peer_url(state.NODE_ID)}/reconcile", timeout=10)
     except Exception as e:
         print(f"[Reconcile Error] Failed to initiate: {e}")
 
@@ -134,5 +180,5 @@ def periodic_replica_discovery():
     threading.Thread(target=check_for_new_nodes, daemon=True).start()
 
 if __name__ == "__main__":
-    time.sleep(1)
-    uvicorn.run(app, host="0.0.0.0", port=NODE_PORT)
+    state.configure()
+    uvicorn.run(app, host="0.0.0.0", port=state.NODE_PORT)
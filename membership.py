@@ -0,0 +1,170 @@
+# membership.py
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+# Failure detection thresholds
+PHI_SUSPECT = 3.0        # phi above which a peer is suspected
+PHI_DEAD = 8.0           # phi above which a peer is declared dead
+DEAD_AFTER = 10.0        # seconds without news after which a peer is dead whatever its phi
+MIN_STD_DEV = 0.2        # seconds, floor on the heartbeat interval spread
+DEFAULT_INTERVAL = 0.5   # seconds, assumed interval before any samples arrive
+ACCEPTABLE_PAUSE = 1.0   # seconds of silence tolerated on top of the usual interval
+
+# Liveness of a single peer. Arrival intervals are sampled from direct contact
+# only; gossip just moves last_seen forward, since a relayed age carries the
+# relay's transit time and would fill the window with near-zero intervals.
+class PeerState:
+    __slots__ = ("last_seen", "last_direct", "intervals")
+
+    def __init__(self):
+        self.last_seen: Optional[float] = None
+        self.last_direct: Optional[float] = None
+        self.intervals = deque(maxlen=100)
+
+    def heard(self, at: float):
+        """Direct contact: a message from, or a reply by, the peer"""
+        # The gap before a dead peer comes back is downtime, not an interval
+        if self.last_direct is not None and at > self.last_direct and self.phi(at) < PHI_DEAD:
+            self.intervals.append(at - self.last_direct)
+        self.last_direct = at
+        self.seen(at)
+
+    def seen(self, at: float):
+        """News of the peer, first hand or gossiped"""
+        if self.last_seen is None or at > self.last_seen:
+            self.last_seen = at
+
+    def phi(self, now: float) -> float:
+        """Phi-accrual suspicion level from a normal fit of arrival intervals"""
+        if self.last_seen is None:
+            return float("inf")
+        if self.intervals:
+            mean = sum(self.intervals) / len(self.intervals)
+            var = sum((i - mean) ** 2 for i in self.intervals) / len(self.intervals)
+        else:
+            mean, var = DEFAULT_INTERVAL, 0.0
+        std = max(math.sqrt(var), MIN_STD_DEV)
+        z = (now - self.last_seen - mean - ACCEPTABLE_PAUSE) / std
+        p_later = 0.5 * math.erfc(z / math.sqrt(2))
+        return -math.log10(max(p_later, 1e-300))
+
+# In-memory cluster view, updated from Raft RPCs and gossiped on them
+class Membership:
+    def __init__(self, node_id: int):
+        self.node_id = node_id
+        self.peers: Dict[int, PeerState] = {}
+        self.lock = threading.Lock()
+
+    def record_contact(self, nid: int):
+        """A message from, or a reply by, nid just arrived"""
+        if nid is None or nid == self.node_id:
+            return
+        with self.lock:
+            self.peers.setdefault(nid, PeerState()).heard(time.monotonic())
+
+    def digest(self) -> Dict[str, float]:
+        """Our view to piggyback on RPCs: seconds since each node was last heard"""
+        now = time.monotonic()
+        with self.lock:
+            view = {str(nid): round(now - p.last_seen, 3) for nid, p in self.peers.items() if p.last_seen is not None}
+        view[str(self.node_id)] = 0.0
+        return view
+
+    def merge_digest(self, digest: Optional[dict]):
+        """Adopt fresher liveness information gossiped by another node"""
+        if not digest:
+            return
+        now = time.monotonic()
+        with self.lock:
+            for nid, age in digest.items():
+                nid = int(nid)
+                if nid == self.node_id:
+                    continue
+                self.peers.setdefault(nid, PeerState()).seen(now - float(age))
+
+    def status(self, nid: int) -> str:
+        if nid == self.node_id:
+            return "alive"
+        now = time.monotonic()
+        with self.lock:
+            peer = self.peers.get(nid)
+            if peer is None or peer.last_seen is None or now - peer.last_seen > DEAD_AFTER:
+                return "dead"
+            phi = peer.phi(now)
+        if phi >= PHI_DEAD:
+            return "dead"
+        return "suspect" if phi >= PHI_SUSPECT else "alive"
+
+    def reachable(self, members) -> set:
+        """Members not declared dead, including ourselves"""
+        return {nid for nid in members if self.status(nid) != "dead"}
+
+    def describe(self, members) -> dict:
+        now = time.monotonic()
+        view = {}
+        for nid in sorted(set(members) | set(self.peers) | {self.node_id}):
+            with self.lock:
+                peer = self.peers.get(nid)
+                last = None if peer is None or peer.last_seen is None else round(now - peer.last_seen, 3)
+                phi = None if peer is None or nid == self.node_id else round(min(peer.phi(now), 1e6), 2)
+            view[str(nid)] = {
+                "status": self.status(nid),
+                "member": nid in members,
+                "last_seen_ago": 0.0 if nid == self.node_id else last,
+                "phi": phi,
+            }
+        return view
+
+# Writes the registry file as an atomic snapshot, at most once per interval
+# and only when the view has changed
+class RegistrySnapshotter:
+    def __init__(self, path: str, build: Callable[[], dict], interval: float = 2.0):
+        self.path = path
+        self.build = build
+        self.interval = interval
+        self.last_written = None
+        self.dirty = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    # Stop the writer thread after one final snapshot
+    def stop(self):
+        self.stopped.set()
+        self.dirty.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def mark_dirty(self):
+        self.dirty.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.dirty.wait(timeout=self.interval)
+            self.dirty.clear()
+            try:
+                self.write_if_changed()
+            except Exception as e:
+                print(f"[Registry Error] Could not write snapshot: {e}")
+            self.stopped.wait(self.interval)
+
+    def write_if_changed(self):
+        view = self.build()
+        if view == self.last_written:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(view, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self.last_written = view
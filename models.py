@@ -1,5 +1,11 @@
 # models.py
-from pydantic import BaseModel
+import hashlib
+import sys
+from dataclasses import dataclass
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+LISTING_FIELDS = ("year", "make", "model", "price", "mileage", "location", "id")
 
 # Request for single city car search
 class FetchRequest(BaseModel):
@@ -15,3 +21,57 @@ class ClientRequest(BaseModel):
     city2: str
     make: str
     model: str
+
+# Request to add or remove a cluster member
+class MembershipRequest(BaseModel):
+    node_id: int
+    address: Optional[str] = None
+
+# Request for filtered, paginated listing query
+class QueryRequest(BaseModel):
+    country: str
+    city: str
+    make: str
+    model: str
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    min_year: Optional[int] = None
+    max_year: Optional[int] = None
+    max_mileage: Optional[float] = None
+    location: Optional[str] = None
+    sort_by: str = "price"
+    descending: bool = False
+    fields: Optional[List[str]] = None
+    limit: int = Field(50, ge=1, le=500)
+    cursor: Optional[str] = None
+
+# Intern repeated categorical strings so identical values share one object
+def intern_str(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+# Stable id for a listing the API returned without one. Price is left out so a
+# price change shows up as a changed listing rather than a new one.
+def listing_key(year, make, model, mileage, location):
+    digest = hashlib.sha1(f"{year}|{make}|{model}|{mileage}|{location}".encode()).hexdigest()
+    return f"h{digest[:16]}"
+
+# Compact listing record, one per car, without a per-instance __dict__
+@dataclass(slots=True)
+class Listing:
+    year: Optional[int]
+    make: str
+    model: str
+    price: float
+    mileage: float
+    location: str
+    id: str = ""
+
+    @classmethod
+    def create(cls, year, make, model, price, mileage, location, id=""):
+        return cls(year, intern_str(make), intern_str(model), price, mileage, intern_str(location), id)
+
+    def as_row(self):
+        return (self.year, self.make, self.model, self.price, self.mileage, self.location, self.id)
+
+    def to_wire(self):
+        return dict(zip(LISTING_FIELDS, self.as_row()))
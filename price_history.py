@@ -0,0 +1,166 @@
+# price_history.py
+# Append-only price history per (make, model, city). Every new version of a
+# cache file is appended as one snapshot: the raw observations go to columnar,
+# month-partitioned files, and a rollup row (count, median price, price/km,
+# ...) is appended alongside, so trend queries read only the rollups.
+#
+#   history/node_<id>/<make>_<model>_<city>/
+#       rollup.f64                 one ROLLUP_FIELDS record per snapshot
+#       2026-10/observed_at.i64    one value per observed listing
+#       2026-10/price.f64
+#       2026-10/mileage.f64
+#       2026-10/id.txt
+import csv
+import os
+import queue
+import statistics
+import threading
+from array import array
+from datetime import datetime, timezone
+import cache_index
+import state
+
+ROLLUP_FIELDS = ("observed_at", "count", "price_median", "price_p25", "price_p75", "price_mean", "ppk_median")
+COLUMNS = (("observed_at", "i64", "q"), ("price", "f64", "d"), ("mileage", "f64", "d"))
+
+BUCKETS = {"hour": 3600_000, "day": 86400_000, "week": 7 * 86400_000}
+
+# Rollups loaded so far (key -> array of ROLLUP_FIELDS records)
+_rollups = {}
+_lock = threading.Lock()
+_pending = queue.Queue()
+
+def _key_dir(key):
+    return os.path.join(state.HISTORY_DIR, key)
+
+def _partition(observed_at):
+    return datetime.fromtimestamp(observed_at / 1000, tz=timezone.utc).strftime("%Y-%m")
+
+def _summarize(observed_at, prices, mileages):
+    ppk = [p / m for p, m in zip(prices, mileages) if m > 0]
+    if len(prices) > 1:
+        p25, median, p75 = statistics.quantiles(prices, n=4, method="inclusive")
+    else:
+        p25 = median = p75 = prices[0]
+    return (observed_at, len(prices), median, p25, p75, statistics.fmean(prices), statistics.median(ppk) if ppk else 0.0)
+
+# A rollup file cut short by a crash loses its partial last record
+def _load_rollup(key):
+    rollup = array("d")
+    path = os.path.join(_key_dir(key), "rollup.f64")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        rollup.frombytes(data[:len(data) - len(data) % (8 * len(ROLLUP_FIELDS))])
+    return rollup
+
+def _rollup(key):
+    rollup = _rollups.get(key)
+    if rollup is None:
+        rollup = _rollups[key] = _load_rollup(key)
+    return rollup
+
+def _append_columns(key, observed_at, ids, prices, mileages):
+    part = os.path.join(_key_dir(key), _partition(observed_at))
+    os.makedirs(part, exist_ok=True)
+    values = {"observed_at": [observed_at] * len(prices), "price": prices, "mileage": mileages}
+    for name, suffix, typecode in COLUMNS:
+        with open(os.path.join(part, f"{name}.{suffix}"), "ab") as f:
+            array(typecode, values[name]).tofile(f)
+    with open(os.path.join(part, "id.txt"), "a") as f:
+        f.writelines(f"{listing_id}\n" for listing_id in ids)
+
+# Append one snapshot of a file's listings, unless a snapshot this recent is
+# already recorded (the same crawl arriving again through reconcile or sync)
+def append(filename, observed_at, ids, prices, mileages):
+    key = os.path.basename(filename)[:-len(".csv")]
+    if not prices:
+        return False
+    with _lock:
+        rollup = _rollup(key)
+        if rollup and rollup[-len(ROLLUP_FIELDS)] >= observed_at:
+            return False
+        _append_columns(key, observed_at, ids, prices, mileages)
+        record = _summarize(observed_at, prices, mileages)
+        with open(os.path.join(_key_dir(key), "rollup.f64"), "ab") as f:
+            array("d", record).tofile(f)
+        rollup.extend(record)
+    return True
+
+def _read_snapshot(filename):
+    ids, prices, mileages = [], [], []
+    with open(os.path.join(state.CACHE_DIR, filename), newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                price = float(row["price"])
+                mileage = float(row["mileage"] or 0)
+            except (ValueError, KeyError):
+                continue
+            if price > 0:
+                ids.append(row.get("id") or "")
+                prices.append(price)
+                mileages.append(mileage)
+    return ids, prices, mileages
+
+def _queue(filename):
+    if filename.endswith(".csv"):
+        _pending.put(filename)
+
+def _record_pending():
+    while True:
+        filename = _pending.get()
+        version = cache_index.version(filename)
+        if version is None:
+            continue
+        try:
+            append(filename, version, *_read_snapshot(filename))
+        except (OSError, ValueError) as e:
+            print(f"[History] Could not record {filename}: {e}")
+
+# Record every new cache file version, whether fetched here or replicated, off
+# the thread that wrote it
+def start_history():
+    os.makedirs(state.HISTORY_DIR, exist_ok=True)
+    cache_index.subscribe(_queue)
+    threading.Thread(target=_record_pending, daemon=True).start()
+
+# Trend series for one file from its rollups: the last snapshot in each bucket,
+# with a rolling mean over the last `window` buckets that have one
+def trend(make, model, city, bucket="day", window=7, since=None, until=None):
+    key = f"{make.lower()}_{model.lower()}_{city.lower()}"
+    size = BUCKETS[bucket]
+    width = len(ROLLUP_FIELDS)
+    with _lock:
+        rollup = _rollup(key) if key in _rollups or os.path.isdir(_key_dir(key)) else array("d")
+        records = [rollup[i:i + width] for i in range(0, len(rollup), width)]
+    latest = {}
+    for record in records:
+        observed_at = record[0]
+        if (since is not None and observed_at < since) or (until is not None and observed_at > until):
+            continue
+        latest[int(observed_at // size * size)] = record
+
+    series = []
+    recent = []
+    for start in sorted(latest):
+        point = dict(zip(ROLLUP_FIELDS, latest[start]))
+        point["observed_at"] = int(point["observed_at"])
+        point["count"] = int(point["count"])
+        recent.append(point)
+        if len(recent) > window:
+            recent.pop(0)
+        series.append({
+            "bucket_start": start,
+            **point,
+            "rolling": {
+                field: statistics.fmean(p[field] for p in recent)
+                for field in ("count", "price_median", "ppk_median")
+            },
+        })
+    return {"key": key, "bucket": bucket, "window": window, "snapshots": len(records), "series": series}
+
+# Keys with recorded history
+def keys():
+    if not os.path.isdir(state.HISTORY_DIR):
+        return []
+    return sorted(name for name in os.listdir(state.HISTORY_DIR) if os.path.isdir(_key_dir(name)))
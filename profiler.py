@@ -0,0 +1,48 @@
+# profiler.py
+import sys
+import threading
+import time
+from collections import Counter
+
+# Sample every thread's stack for a while and count identical stacks
+def sample_stacks(seconds: float, interval: float = 0.005) -> Counter:
+    own_thread = threading.get_ident()
+    names = {}
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread in threading.enumerate():
+            names[thread.ident] = thread.name
+        for ident, frame in sys._current_frames().items():
+            if ident == own_thread:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            frames.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(frames))] += 1
+        time.sleep(interval)
+    return stacks
+
+# Collapsed-stack text, readable by flamegraph.pl and speedscope
+def to_collapsed(stacks: Counter) -> str:
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+# Functions ranked by how often they were on top of a stack (self) or anywhere in it (total)
+def to_summary(stacks: Counter, top: int = 30) -> dict:
+    own, total = Counter(), Counter()
+    samples = sum(stacks.values())
+    for stack, count in stacks.items():
+        frames = stack.split(";")[1:]
+        if not frames:
+            continue
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return {
+        "samples": samples,
+        "self": [{"frame": f, "samples": c} for f, c in own.most_common(top)],
+        "total": [{"frame": f, "samples": c} for f, c in total.most_common(top)],
+    }
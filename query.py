@@ -0,0 +1,131 @@
+# query.py
+import base64
+import hashlib
+import heapq
+import json
+import os
+from car_fetching import cache_filename, is_recent, iter_cars, iter_csv
+from models import LISTING_FIELDS
+import state
+
+SORTABLE_FIELDS = ("price", "mileage", "year")
+
+class QueryError(ValueError):
+    pass
+
+# Build a row filter from the request's predicates
+def build_predicate(q):
+    checks = []
+    if q.min_price is not None:
+        checks.append(lambda r: r.price is not None and r.price >= q.min_price)
+    if q.max_price is not None:
+        checks.append(lambda r: r.price is not None and r.price <= q.max_price)
+    if q.min_year is not None:
+        checks.append(lambda r: r.year is not None and r.year >= q.min_year)
+    if q.max_year is not None:
+        checks.append(lambda r: r.year is not None and r.year <= q.max_year)
+    if q.max_mileage is not None:
+        checks.append(lambda r: r.mileage is not None and r.mileage <= q.max_mileage)
+    if q.location:
+        needle = q.location.lower()
+        checks.append(lambda r: needle in (r.location or "").lower())
+    return lambda row: all(check(row) for check in checks)
+
+# Sort key: rows with a missing value always go last, ties broken by file position
+def build_sort_key(sort_by, descending):
+    sign = -1 if descending else 1
+    def key(pos, row):
+        value = getattr(row, sort_by)
+        if value is None:
+            return (1, 0, pos)
+        return (0, sign * value, pos)
+    return key
+
+# Fingerprint of what decides a query's row order: key, filters and sort.
+# Fields and limit can change between pages.
+QUERY_SHAPE = ("country", "city", "make", "model", "min_price", "max_price", "min_year",
+               "max_year", "max_mileage", "location", "sort_by", "descending")
+
+def query_fingerprint(q):
+    shape = json.dumps([getattr(q, name) for name in QUERY_SHAPE])
+    return hashlib.sha256(shape.encode()).hexdigest()[:16]
+
+# Opaque keyset cursor encoding, tied to the query it came from
+def encode_cursor(key, q):
+    return base64.urlsafe_b64encode(json.dumps({"q": query_fingerprint(q), "k": list(key)}).encode()).decode()
+
+# A cursor is the query's fingerprint plus a sort key from build_sort_key:
+# [0|1, value, position]
+def decode_cursor(cursor, q):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise QueryError("Invalid cursor")
+    if not isinstance(data, dict) or "k" not in data:
+        raise QueryError("Invalid cursor")
+    if data.get("q") != query_fingerprint(q):
+        raise QueryError("Cursor belongs to a query with different filters or sort order")
+    key = data["k"]
+    if (
+        not isinstance(key, list) or len(key) != 3
+        or key[0] not in (0, 1) or isinstance(key[0], bool)
+        or not isinstance(key[1], (int, float)) or isinstance(key[1], bool)
+        or not isinstance(key[2], int) or isinstance(key[2], bool)
+    ):
+        raise QueryError("Invalid cursor")
+    return tuple(key)
+
+# Iterate listings for a query, reading the cache file row by row when it is fresh
+def iter_listings(q, allow_fetch=True):
+    filepath = os.path.join(state.CACHE_DIR, cache_filename(q.make, q.model, q.city))
+    if is_recent(filepath):
+        return iter_csv(filepath)
+    if not allow_fetch:
+        return None
+    return iter_cars(q.country, q.city, q.make, q.model)
+
+# Run a filtered, sorted, projected and paginated query
+def run_query(q, allow_fetch=True):
+    if q.sort_by not in SORTABLE_FIELDS:
+        raise QueryError(f"Cannot sort by '{q.sort_by}'")
+    fields = q.fields or list(LISTING_FIELDS)
+    unknown = [f for f in fields if f not in LISTING_FIELDS]
+    if unknown:
+        raise QueryError(f"Unknown fields: {unknown}")
+
+    listings = iter_listings(q, allow_fetch)
+    if listings is None:
+        return None
+
+    predicate = build_predicate(q)
+    key = build_sort_key(q.sort_by, q.descending)
+    after = decode_cursor(q.cursor, q) if q.cursor else None
+
+    # Only keep the limit + 1 best candidates in memory while scanning
+    matched = 0
+    candidates = []
+    for pos, row in enumerate(listings):
+        if not predicate(row):
+            continue
+        matched += 1
+        k = key(pos, row)
+        if after is not None and k <= after:
+            continue
+        candidates.append((k, row))
+        if len(candidates) > 4 * (q.limit + 1):
+            candidates = heapq.nsmallest(q.limit + 1, candidates, key=lambda c: c[0])
+
+    page = heapq.nsmallest(q.limit + 1, candidates, key=lambda c: c[0])
+    next_cursor = None
+    if len(page) > q.limit:
+        page = page[:q.limit]
+        next_cursor = encode_cursor(page[-1][0], q)
+
+    return {
+        "city": q.city,
+        "model": q.model,
+        "total_matches": matched,
+        "count": len(page),
+        "listings": [{f: getattr(row, f) for f in fields} for _, row in page],
+        "next_cursor": next_cursor,
+    }
@@ -1,28 +1,50 @@
 import random
 import time
 import threading
-import json
 import os
+import sys
+from dataclasses import dataclass
 from enum import Enum
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 import requests
 from config import CLUSTER_NODES, NODE_REGISTRY
+from cluster import ClusterConfig
+from membership import Membership, RegistrySnapshotter
+from contextlib import nullcontext
+from metrics import Counter, Gauge, Histogram
+from tracing import span
+from serialization import JSON_TYPE, preferred_rpc_type, encode_rpc, decode_rpc
+
+APPEND_ENTRIES_RTT = Histogram("carbitrage_raft_append_entries_rtt_seconds", "AppendEntries round trip time", labels=("peer",))
+COMMIT_LATENCY = Histogram("carbitrage_raft_commit_latency_seconds", "Time from append_command to apply on the leader")
+ELECTIONS = Counter("carbitrage_raft_elections_total", "Elections started by this node", labels=("result",))
+REPLICATION_LAG = Gauge("carbitrage_raft_replication_lag_entries", "Leader log length minus the peer's match_index", labels=("peer",))
+LOG_ENTRIES = Gauge("carbitrage_raft_log_entries", "Entries in this node's log")
+COMMIT_INDEX = Gauge("carbitrage_raft_commit_index", "Highest log index known to be committed")
+CURRENT_TERM = Gauge("carbitrage_raft_term", "Current Raft term")
 
 class NodeState(Enum):
     FOLLOWER = "follower"
     CANDIDATE = "candidate"
     LEADER = "leader"
 
+@dataclass(slots=True)
 class LogEntry:
-    def __init__(self, term: int, command: dict, index: int):
-        self.term = term
-        self.command = command
-        self.index = index
+    term: int
+    command: dict
+    index: int
+
+    def __post_init__(self):
+        # Command types and filenames repeat across the log, share one copy of each
+        for key in ("type", "filename"):
+            if isinstance(self.command.get(key), str):
+                self.command[key] = sys.intern(self.command[key])
 
 class RaftNode:
-    def __init__(self, node_id: int):
+    def __init__(self, node_id: int, address: str):
         self.node_id = node_id
+        self.address = address
         self.current_term = 0
         self.voted_for = None
         self.log: List[LogEntry] = []
@@ -32,72 +54,111 @@ class RaftNode:
         self.commit_index = 0
         self.last_applied = 0
         
+        # Cluster membership, replaced by the latest config entry in the log.
+        # A node outside the bootstrap config knows its own address but doesn't vote.
+        self.bootstrap_config = ClusterConfig.bootstrap(CLUSTER_NODES)
+        if node_id not in self.bootstrap_config.addresses:
+            self.bootstrap_config = ClusterConfig(
+                voters=self.bootstrap_config.voters,
+                addresses={**self.bootstrap_config.addresses, node_id: address},
+            )
+        self.config = self.bootstrap_config
+        self.config_index = 0
+        self.config_lock = threading.Lock()
+
         # Leader state
-        self.next_index: Dict[int, int] = {nid: 1 for nid in CLUSTER_NODES.keys()}
-        self.match_index: Dict[int, int] = {nid: 0 for nid in CLUSTER_NODES.keys()}
+        self.next_index: Dict[int, int] = {nid: 1 for nid in self.config.members()}
+        self.match_index: Dict[int, int] = {nid: 0 for nid in self.config.members()}
         
         # Election timeout
         self.MIN_TIMEOUT = 2.0  # seconds
         self.MAX_TIMEOUT = 4.0  # seconds
         self.HEARTBEAT_INTERVAL = 0.5  # seconds
+        self.DEPARTING_TIMEOUT = 60.0  # seconds to keep replicating C_new to removed voters
         
         # Add heartbeat timer
         self.heartbeat_timer = None
+
+        # Wire format negotiated per peer for Raft RPCs
+        self.peer_rpc_type: Dict[int, str] = {}
         
-        # Persist term number
+        # Persist term number, loaded by start()
         self.term_file = f"term_{node_id}.txt"
-        self.load_persistent_state()
+        self.log_loaded = False
         
-        # Initialize node registry
-        self.initialize_node_registry()
+        # Peer liveness, gossiped on Raft RPCs, with the registry file as a snapshot of it
+        self.membership = Membership(node_id)
+        self.dead_peer_retry = 2.0  # seconds between AppendEntries attempts to dead peers
+        self.next_dead_retry: Dict[int, float] = {}
+        self.registry = RegistrySnapshotter(NODE_REGISTRY, self._registry_view)
+
+        # Metrics computed at scrape time, plus append times for commit latency
+        self.append_times: Dict[int, float] = {}
+        REPLICATION_LAG.set_function(self._replication_lag)
+        LOG_ENTRIES.set_function(lambda: len(self.log))
+        COMMIT_INDEX.set_function(lambda: self.commit_index)
+        CURRENT_TERM.set_function(lambda: self.current_term)
         
         # Initialize last_heartbeat
         self.last_heartbeat = datetime.now()
         self.election_timeout = self.get_random_timeout()
-        
-        # Start election timer
+        # When a valid AppendEntries last arrived from a leader (monotonic)
+        self.last_leader_contact = None
+
+        # Voters dropped by the last C_new, still replicated to until they have it
+        # so they learn they were removed and stop campaigning (nid -> address)
+        self.departing: Dict[int, str] = {}
+        self.departing_index = 0
+        self.departing_deadline = 0.0
+
+        # Background threads, started by start() and stopped by stop()
+        self.stopped = threading.Event()
+        self.election_timer = None
+        self.commit_checker = None
+
+    def start(self):
+        """Load persisted state and start the election timer, commit checker and registry snapshots"""
+        if self.election_timer is not None:
+            return
+        self.load_persistent_state()
+        self.log_loaded = True
+        self.stopped.clear()
+        # A full election timeout from now, so the HTTP server is listening before any campaign
+        self.last_heartbeat = datetime.now()
+        self.registry.start()
+        self.registry.mark_dirty()
         self.election_timer = threading.Thread(target=self._run_election_timer, daemon=True)
         self.election_timer.start()
-        
-        # Start commit checker
         self.commit_checker = threading.Thread(target=self._check_commits, daemon=True)
         self.commit_checker.start()
 
-    def initialize_node_registry(self):
-        """Initialize or load the node registry file"""
-        if not os.path.exists(NODE_REGISTRY):
-            with open(NODE_REGISTRY, 'w') as f:
-                json.dump({}, f)
-        self.update_node_registry(self.node_id, True, False)
-
-    def update_node_registry(self, node_id: int, is_online: bool, is_leader: bool, is_candidate: bool = False):
-        """Update the node registry with node status"""
-        try:
-            if not os.path.exists(NODE_REGISTRY):
-                with open(NODE_REGISTRY, 'w') as f:
-                    json.dump({}, f)
-
-            with open(NODE_REGISTRY, 'r') as f:
-                try:
-                    registry = json.load(f)
-                except json.JSONDecodeError:
-                    registry = {}
-
-            if not isinstance(registry, dict):
-                registry = {}
-
-            if str(node_id) not in registry:
-                registry[str(node_id)] = {}
-
-            registry[str(node_id)]["id"] = node_id
-            registry[str(node_id)]["online"] = is_online
-            registry[str(node_id)]["role"] = "leader" if is_leader else "replica"
-            registry[str(node_id)]["candidate"] = is_candidate
+    def stop(self):
+        """Stop background threads and step down, persisting the current term"""
+        self.stopped.set()
+        self.state = NodeState.FOLLOWER
+        if self.heartbeat_timer:
+            self.heartbeat_timer.cancel()
+        for thread in (self.election_timer, self.commit_checker):
+            if thread is not None:
+                thread.join(timeout=1.0)
+        self.election_timer = None
+        self.commit_checker = None
+        self.registry.stop()
+        if self.log_loaded:
+            self.save_term()
 
-            with open(NODE_REGISTRY, 'w') as f:
-                json.dump(registry, f, indent=2)
-        except Exception as e:
-            print(f"[Registry Error] Could not update registry: {e}")
+    def _registry_view(self) -> dict:
+        """Node registry contents as seen by this node"""
+        leader = self.node_id if self.state == NodeState.LEADER else getattr(self, "current_leader", None)
+        registry = {}
+        for nid in sorted(self.config.members() | {self.node_id}):
+            registry[str(nid)] = {
+                "id": nid,
+                "online": self.membership.status(nid) != "dead",
+                "role": "leader" if nid == leader else "replica",
+                "candidate": nid == self.node_id and self.state == NodeState.CANDIDATE,
+            }
+        return registry
 
     def load_persistent_state(self):
         """Load persistent state from disk"""
@@ -118,15 +179,21 @@ class RaftNode:
         return random.uniform(self.MIN_TIMEOUT, self.MAX_TIMEOUT)
 
     def _run_election_timer(self):
-        while True:
-            time.sleep(0.1)  # Check every 100ms
+        while not self.stopped.wait(0.1):  # Check every 100ms
             if self.state == NodeState.LEADER:
                 continue
+            # Learners and removed nodes never campaign
+            if not self.config.is_voter(self.node_id):
+                self.last_heartbeat = datetime.now()
+                continue
             
             time_since_last_heartbeat = (datetime.now() - self.last_heartbeat).total_seconds()
             if time_since_last_heartbeat > self.election_timeout:
                 # Only start election if we have potential voters
                 active_nodes = self.get_active_nodes()
+                if len(active_nodes) <= 1:
+                    # Nobody heard from recently (e.g. at startup), ask directly
+                    active_nodes = self.probe_peers()
                 if len(active_nodes) > 1:  # More than just ourselves
                     self.start_election()
                 else:
@@ -142,13 +209,16 @@ class RaftNode:
         self.voted_for = self.node_id
         self.last_heartbeat = datetime.now()
         self.election_timeout = self.get_random_timeout()
+        self.registry.mark_dirty()
 
-        votes_received = 1  # Vote for self
+        config = self.config
+        granted = {self.node_id}  # Vote for self
+        votes_received = 1
         print(f"\n[RAFT] Node {self.node_id} starting election for term {self.current_term}")
         print(f"[RAFT] Node {self.node_id} voting for self (1 vote)")
         
-        # Request votes from all other nodes
-        for nid, port in CLUSTER_NODES.items():
+        # Request votes from every voter in the current (possibly joint) config
+        for nid in config.all_voters():
             if nid == self.node_id:
                 continue
 
@@ -160,18 +230,17 @@ class RaftNode:
                     "term": self.current_term,
                     "candidate_id": self.node_id,
                     "last_log_index": last_log_index,
-                    "last_log_term": last_log_term
+                    "last_log_term": last_log_term,
+                    "members": self.membership.digest()
                 }
 
-                response = requests.post(
-                    f"http://localhost:{port}/raft/request_vote",
-                    json=data,
-                    timeout=0.5
-                )
+                result = self._post_rpc(nid, "/raft/request_vote", data, timeout=0.5)
 
-                if response.status_code == 200:
-                    result = response.json()
+                if result is not None:
+                    self.membership.record_contact(nid)
+                    self.membership.merge_digest(result.get("members"))
                     if result.get("vote_granted"):
+                        granted.add(nid)
                         votes_received += 1
                         print(f"[RAFT] Node {nid} voted for Node {self.node_id} ({votes_received} votes)")
                     else:
@@ -180,15 +249,17 @@ class RaftNode:
             except Exception as e:
                 print(f"[RAFT] Node {nid} unreachable")
 
-        # Check if we won the election
-        needed_votes = (len(CLUSTER_NODES) // 2) + 1
+        # Check if we won the election (a majority of both configs while joint)
+        needed_votes = (len(config.voters) // 2) + 1
         print(f"[RAFT] Node {self.node_id} received {votes_received} votes (need {needed_votes} to win)")
         
-        if votes_received >= needed_votes:
+        if config.has_quorum(granted):
             print(f"[RAFT] Node {self.node_id} won election for term {self.current_term}!")
+            ELECTIONS.labels("won").inc()
             self.become_leader()
         else:
             print(f"[RAFT] Node {self.node_id} lost election for term {self.current_term}")
+            ELECTIONS.labels("lost").inc()
             self.state = NodeState.FOLLOWER
 
     def become_leader(self):
@@ -197,8 +268,10 @@ class RaftNode:
 
         print(f"\n[RAFT] Node {self.node_id} has become the leader for term {self.current_term}!\n")
         self.state = NodeState.LEADER
-        self.next_index = {nid: len(self.log) + 1 for nid in CLUSTER_NODES.keys()}
-        self.match_index = {nid: 0 for nid in CLUSTER_NODES.keys()}
+        self.registry.mark_dirty()
+        self.next_index = {nid: len(self.log) + 1 for nid in self.config.members()}
+        self.match_index = {nid: 0 for nid in self.config.members()}
+        self.append_times.clear()
         
         # Start regular heartbeat
         if self.heartbeat_timer:
@@ -209,8 +282,9 @@ class RaftNode:
 
     def _heartbeat_loop(self):
         """Continuous heartbeat loop for leader"""
-        while self.state == NodeState.LEADER:
+        while self.state == NodeState.LEADER and not self.stopped.is_set():
             self.send_heartbeat()
+            self._advance_membership()
             time.sleep(self.HEARTBEAT_INTERVAL)
 
     def send_heartbeat(self):
@@ -218,18 +292,24 @@ class RaftNode:
             return
 
         active_nodes = set()  # Track responsive nodes
-        for nid, port in CLUSTER_NODES.items():
+        digest = self.membership.digest()
+        now = time.monotonic()
+        if self.departing and now >= self.departing_deadline:
+            print(f"[RAFT] Giving up on replicating the new config to removed nodes {sorted(self.departing)}")
+            self.departing = {}
+        # Replicate to voters and learners alike, and to removed voters until they have C_new
+        for nid in self.config.members() | set(self.departing):
             if nid == self.node_id:
                 continue
 
-            try:
-                # First check if node is alive
-                health_check = requests.get(f"http://localhost:{port}/health", timeout=0.1)
-                if health_check.status_code != 200:
+            # Peers declared dead are only retried every few seconds
+            if self.membership.status(nid) == "dead":
+                if now < self.next_dead_retry.get(nid, 0):
                     continue
+                self.next_dead_retry[nid] = now + self.dead_peer_retry
 
-                active_nodes.add(nid)
-                next_idx = self.next_index[nid]
+            try:
+                next_idx = self.next_index.setdefault(nid, len(self.log) + 1)
                 prev_log_index = next_idx - 1
                 prev_log_term = self.log[prev_log_index - 1].term if prev_log_index > 0 else 0
 
@@ -240,22 +320,27 @@ class RaftNode:
                     "leader_id": self.node_id,
                     "prev_log_index": prev_log_index,
                     "prev_log_term": prev_log_term,
-                    "entries": [{"term": e.term, "command": e.command} for e in entries],
-                    "leader_commit": self.commit_index
+                    "entries": [(e.term, e.command) for e in entries],
+                    "leader_commit": self.commit_index,
+                    "members": digest
                 }
 
-                response = requests.post(
-                    f"http://localhost:{port}/raft/append_entries",
-                    json=data,
-                    timeout=0.2
-                )
+                sent_at = time.perf_counter()
+                with self._trace_span("raft.append_entries.send", entries, peer=nid, count=len(entries)):
+                    result = self._post_rpc(nid, "/raft/append_entries", data, timeout=0.2)
 
-                if response.status_code == 200:
-                    result = response.json()
+                if result is not None:
+                    APPEND_ENTRIES_RTT.labels(nid).observe(time.perf_counter() - sent_at)
+                    active_nodes.add(nid)
+                    self.membership.record_contact(nid)
+                    self.membership.merge_digest(result.get("members"))
                     if result.get("success"):
                         if entries:
                             self.match_index[nid] = prev_log_index + len(entries)
                             self.next_index[nid] = self.match_index[nid] + 1
+                        if nid in self.departing and self.match_index.get(nid, 0) >= self.departing_index:
+                            print(f"[RAFT] Removed node {nid} has the new config, no longer replicating to it")
+                            del self.departing[nid]
                     else:
                         self.next_index[nid] = max(1, self.next_index[nid] - 1)
 
@@ -265,7 +350,44 @@ class RaftNode:
             except Exception as e:
                 print(f"[RAFT] Unexpected error with node {nid}: {e}")
 
+    def peer_url(self, nid: int) -> str:
+        """Base URL of a cluster member (this node's own, or a departing voter's, even once removed from the config)"""
+        if nid not in self.config.addresses:
+            if nid == self.node_id:
+                return f"http://{self.address}"
+            if nid in self.departing:
+                return f"http://{self.departing[nid]}"
+        return self.config.url(nid)
+
+    def _post_rpc(self, nid: int, path: str, data: dict, timeout: float) -> Optional[dict]:
+        """POST a Raft RPC in the peer's negotiated wire format and decode the reply"""
+        content_type = self.peer_rpc_type.get(nid, preferred_rpc_type())
+        response = requests.post(
+            f"{self.peer_url(nid)}{path}",
+            data=encode_rpc(data, content_type),
+            headers={"Content-Type": content_type, "Accept": content_type},
+            timeout=timeout
+        )
+        if response.status_code == 415 and content_type != JSON_TYPE:
+            # Peer can't decode our preferred format, use JSON for it from now on
+            self.peer_rpc_type[nid] = JSON_TYPE
+            return self._post_rpc(nid, path, data, timeout)
+        if response.status_code != 200:
+            return None
+        reply_type = response.headers.get("content-type", JSON_TYPE).split(";")[0].strip()
+        return decode_rpc(response.content, reply_type)
+
     def handle_append_entries(self, data: dict) -> dict:
+        """AppendEntries RPC, also exchanging membership digests with the leader"""
+        self.membership.record_contact(data.get("leader_id"))
+        self.membership.merge_digest(data.get("members"))
+        entries = data.get("entries") or []
+        with self._trace_span("raft.append_entries.receive", entries, leader=data.get("leader_id"), count=len(entries)):
+            reply = self._append_entries(data)
+        reply["members"] = self.membership.digest()
+        return reply
+
+    def _append_entries(self, data: dict) -> dict:
         term = data.get("term", 0)
         
         # If we see a higher term, step down
@@ -280,6 +402,7 @@ class RaftNode:
         # Reset election timeout if we get a valid append entries
         if term >= self.current_term:
             self.last_heartbeat = datetime.now()
+            self.last_leader_contact = time.monotonic()
         
         leader_id = data.get("leader_id")
         
@@ -311,17 +434,29 @@ class RaftNode:
 
         # Process entries
         entries = data.get("entries", [])
+        config_changed = False
         for i, entry in enumerate(entries):
             log_index = prev_log_index + i + 1
+            # Entries arrive as compact [term, command] pairs (older leaders send dicts)
+            if isinstance(entry, dict):
+                entry_term, entry_command = entry["term"], entry["command"]
+            else:
+                entry_term, entry_command = entry
             
             # If an existing entry conflicts with a new one, delete it and all that follow
             if log_index <= len(self.log):
-                if self.log[log_index - 1].term != entry["term"]:
+                if self.log[log_index - 1].term != entry_term:
                     self.log = self.log[:log_index - 1]
+                    config_changed = config_changed or self.config_index >= log_index
             
             # Append any new entries not already in the log
             if log_index > len(self.log):
-                self.log.append(LogEntry(entry["term"], entry["command"], log_index))
+                self.log.append(LogEntry(entry_term, entry_command, log_index))
+                config_changed = config_changed or entry_command.get("type") == "config"
+
+        # Membership changes take effect as soon as they are in the log
+        if config_changed:
+            self._refresh_config()
 
         # Update commit index
         leader_commit = data.get("leader_commit", 0)
@@ -331,9 +466,29 @@ class RaftNode:
         return {"term": self.current_term, "success": True}
 
     def handle_request_vote(self, data: dict) -> dict:
+        """RequestVote RPC, also exchanging membership digests with the candidate"""
+        self.membership.record_contact(data.get("candidate_id"))
+        self.membership.merge_digest(data.get("members"))
+        reply = self._request_vote(data)
+        reply["members"] = self.membership.digest()
+        return reply
+
+    def _leader_is_live(self) -> bool:
+        """Whether this node leads, or heard from a leader within the minimum election timeout"""
+        if self.state == NodeState.LEADER:
+            return True
+        return self.last_leader_contact is not None and time.monotonic() - self.last_leader_contact < self.MIN_TIMEOUT
+
+    def _request_vote(self, data: dict) -> dict:
         term = data.get("term", 0)
         candidate_id = data.get("candidate_id")
-        
+
+        # Raft §6: while a leader is live, a candidate (e.g. a removed voter that no
+        # longer gets heartbeats) must not depose it by bumping the term
+        if term > self.current_term and self._leader_is_live():
+            print(f"[RAFT] Node {self.node_id} ignoring vote request from Node {candidate_id}: leader is live")
+            return {"term": self.current_term, "vote_granted": False}
+
         if term < self.current_term:
             print(f"[RAFT] Node {self.node_id} rejecting vote: candidate term {term} < current term {self.current_term}")
             return {"term": self.current_term, "vote_granted": False}
@@ -365,26 +520,51 @@ class RaftNode:
         return {"term": self.current_term, "vote_granted": False}
 
     def _check_commits(self):
-        while True:
-            time.sleep(0.1)
+        while not self.stopped.wait(0.1):
             if self.state == NodeState.LEADER:
-                # Find highest N that majority of matchIndex[i] ≥ N
+                # Find highest N replicated on a majority (of both configs while joint)
+                config = self.config
                 for N in range(self.commit_index + 1, len(self.log) + 1):
                     if self.log[N-1].term == self.current_term:
-                        match_count = 1  # Count self
-                        for nid in CLUSTER_NODES:
+                        replicated = {self.node_id}  # Count self
+                        for nid in config.all_voters():
                             if nid != self.node_id and self.match_index.get(nid, 0) >= N:
-                                match_count += 1
-                        if match_count > len(CLUSTER_NODES) // 2:
+                                replicated.add(nid)
+                        if config.has_quorum(replicated):
                             self.commit_index = N
 
-            # Apply committed entries to state machine
-            while self.last_applied < self.commit_index:
-                self.last_applied += 1
-                self._apply_log_entry(self.log[self.last_applied - 1])
+            # Apply committed entries to state machine, batching the cache
+            # file fsyncs when several are applied at once (e.g. catch-up)
+            if self.last_applied < self.commit_index:
+                import cache_store
+                with cache_store.batch() if self.commit_index - self.last_applied > 1 else nullcontext():
+                    while self.last_applied < self.commit_index:
+                        self.last_applied += 1
+                        self._apply_log_entry(self.log[self.last_applied - 1])
+                        appended_at = self.append_times.pop(self.last_applied, None)
+                        if appended_at is not None:
+                            COMMIT_LATENCY.observe(time.perf_counter() - appended_at)
+
+    def _trace_span(self, name: str, entries, **attributes):
+        """Span joined to the trace of the first traced entry, or a no-op if none is traced"""
+        for entry in entries:
+            if isinstance(entry, LogEntry):
+                command = entry.command
+            elif isinstance(entry, dict):
+                command = entry.get("command", {})
+            else:
+                command = entry[1]
+            trace = command.get("trace")
+            if trace:
+                return span(name, trace_id=trace["trace_id"], parent_id=trace["span_id"], node=self.node_id, **attributes)
+        return nullcontext()
 
     def _apply_log_entry(self, entry: LogEntry):
         """Apply a log entry to the state machine"""
+        with self._trace_span("raft.apply", [entry], index=entry.index, type=entry.command.get("type")):
+            self._apply_command(entry)
+
+    def _apply_command(self, entry: LogEntry):
         command = entry.command
         # Handle different command types
         if command.get("type") == "set_leader":
@@ -392,17 +572,26 @@ class RaftNode:
             set_leader(command.get("leader_id"))
         elif command.get("type") == "replicate_file":
             self._handle_file_replication(command)
+        elif command.get("type") == "replicate_delta":
+            import cache_delta
+            cache_delta.apply_command(command)
+        elif command.get("type") == "evict_files":
+            from cache_manager import apply_evictions
+            apply_evictions(command.get("files", []), command.get("evicted_at"))
+        elif command.get("type") == "config":
+            print(f"[RAFT] Membership committed at index {entry.index}: {ClusterConfig.from_command(command).describe()}")
 
     def _handle_file_replication(self, command: dict):
         """Handle file replication commands"""
         filename = command.get("filename")
         file_data = command.get("data")
         if filename and file_data:
-            from state import CACHE_DIR
-            import os
-            filepath = os.path.join(CACHE_DIR, filename)
-            with open(filepath, "wb") as f:
-                f.write(file_data.encode())
+            import cache_store
+            version = command.get("version")
+            # The leader already holds this version from save_to_csv
+            if cache_store.has_version(filename, version):
+                return
+            cache_store.write_file(filename, file_data.encode(), version)
 
     def append_command(self, command: dict) -> bool:
         """Append a new command to the log if leader"""
@@ -411,18 +600,115 @@ class RaftNode:
         
         entry = LogEntry(self.current_term, command, len(self.log) + 1)
         self.log.append(entry)
+        self.append_times[entry.index] = time.perf_counter()
+        if command.get("type") == "config":
+            self._refresh_config()
         return True 
 
+    def _refresh_config(self):
+        """Adopt the latest config entry in the log, or the bootstrap config if none"""
+        for entry in reversed(self.log):
+            if entry.command.get("type") == "config":
+                self.config = ClusterConfig.from_command(entry.command)
+                self.config_index = entry.index
+                break
+        else:
+            self.config = self.bootstrap_config
+            self.config_index = 0
+        print(f"[RAFT] Node {self.node_id} now using membership {self.config.describe()}")
+
+    def _propose_config(self, config: ClusterConfig) -> Optional[str]:
+        """Append a new membership config, returning an error message on refusal"""
+        if self.state != NodeState.LEADER:
+            return "This node is not the leader"
+        if self.config.is_joint() or self.config_index > self.commit_index:
+            return "A membership change is already in progress"
+        self.append_command(config.to_command())
+        return None
+
+    def add_learner(self, node_id: int, address: str) -> Optional[str]:
+        """Start replicating to a new node; it is promoted once caught up"""
+        with self.config_lock:
+            config = self.config
+            if node_id in config.members():
+                return f"Node {node_id} is already a member"
+            return self._propose_config(ClusterConfig(
+                voters=config.voters,
+                learners=config.learners | {node_id},
+                addresses={**config.addresses, node_id: address},
+            ))
+
+    def remove_node(self, node_id: int) -> Optional[str]:
+        """Remove a voter or learner, going through joint consensus for voters"""
+        with self.config_lock:
+            config = self.config
+            if node_id not in config.members():
+                return f"Node {node_id} is not a member"
+            if node_id in config.learners:
+                addresses = {nid: addr for nid, addr in config.addresses.items() if nid != node_id}
+                return self._propose_config(ClusterConfig(voters=config.voters, learners=config.learners - {node_id}, addresses=addresses))
+            if len(config.voters) == 1:
+                return "Cannot remove the last voter"
+            return self._propose_config(ClusterConfig(
+                voters=config.voters - {node_id},
+                old_voters=config.voters,
+                learners=config.learners,
+                addresses=config.addresses,
+            ))
+
+    def _advance_membership(self):
+        """Leader-side membership steps: promote caught-up learners and finish joint changes"""
+        with self.config_lock:
+            config = self.config
+            if self.config_index > self.commit_index:
+                return
+            if config.is_joint():
+                # C_old,new is committed, move on to C_new alone
+                removed = config.old_voters - config.voters
+                addresses = {nid: addr for nid, addr in config.addresses.items() if nid not in removed}
+                self.append_command(ClusterConfig(voters=config.voters, learners=config.learners, addresses=addresses).to_command())
+                self.departing = {nid: config.addresses[nid] for nid in removed if nid != self.node_id and nid in config.addresses}
+                self.departing_index = len(self.log)
+                self.departing_deadline = time.monotonic() + self.DEPARTING_TIMEOUT
+                return
+            if self.node_id not in config.voters:
+                # C_new committed without us: step down
+                print(f"[RAFT] Node {self.node_id} removed from cluster, stepping down")
+                self.state = NodeState.FOLLOWER
+                return
+            for nid in sorted(config.learners):
+                if self.match_index.get(nid, 0) >= self.commit_index:
+                    print(f"[RAFT] Learner {nid} caught up, promoting to voter")
+                    self._propose_config(ClusterConfig(
+                        voters=config.voters | {nid},
+                        old_voters=config.voters,
+                        learners=config.learners - {nid},
+                        addresses=config.addresses,
+                    ))
+                    return
+
+    def _replication_lag(self) -> dict:
+        """Entries each peer is behind the leader's log (empty on followers)"""
+        if self.state != NodeState.LEADER:
+            return {}
+        return {
+            (nid,): len(self.log) - self.match_index.get(nid, 0)
+            for nid in self.config.members() if nid != self.node_id
+        }
+
     def get_active_nodes(self):
-        """Return set of currently active node IDs"""
-        active = {self.node_id}  # Include self
-        for nid, port in CLUSTER_NODES.items():
+        """Return set of node IDs not declared dead by the failure detector"""
+        return self.membership.reachable(self.config.members()) | {self.node_id}
+
+    def probe_peers(self):
+        """Directly probe every member's /health, used only when no peer has been heard from"""
+        for nid in self.config.members():
             if nid == self.node_id:
                 continue
             try:
-                response = requests.get(f"http://localhost:{port}/health", timeout=0.1)
+                response = requests.get(f"{self.peer_url(nid)}/health", timeout=0.1)
                 if response.status_code == 200:
-                    active.add(nid)
+                    self.membership.record_contact(nid)
             except:
                 continue
-        return active 
\ No newline at end of file
+        return self.get_active_nodes() 
\ No newline at end of file
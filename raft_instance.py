@@ -1,5 +1,12 @@
+import state
 from raft import RaftNode, NodeState
-from state import NODE_ID
 
-# Create a singleton instance of RaftNode
-raft_node = RaftNode(NODE_ID) 
\ No newline at end of file
+# Singleton RaftNode, created by init_raft_node() during app startup.
+# Read it as raft_instance.raft_node so importers see the live instance.
+raft_node = None
+
+def init_raft_node():
+    global raft_node
+    if raft_node is None:
+        raft_node = RaftNode(state.NODE_ID, state.NODE_ADDRESS)
+    return raft_node
@@ -1,23 +1,98 @@
 # routes.py
 import os
+import time
+import requests
 from fastapi import APIRouter, Request, UploadFile, File, Form
-from config import CLUSTER_NODES
-from models import FetchRequest, ClientRequest
-from car_fetching import fetch_cars, save_to_csv
-from state import NODE_ID, get_leader, set_leader, CACHE_DIR
-from raft_instance import raft_node
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from config import SHARDING_ENABLED
+from models import FetchRequest, ClientRequest, QueryRequest, MembershipRequest
+from car_fetching import cache_filename, fetch_cars, is_recent, iter_cars, save_to_csv
+import cache_index
+import cache_manager
+import cache_store
+import raft_instance
+import state
+from state import get_leader, set_leader
+from query import run_query, QueryError
+from arbitrage import METRICS, SCANNER
+import price_history
+from serialization import FastJSONResponse, dumps_json, read_rpc, rpc_response
+from sharding import FORWARDED_HEADER, owners_for, route_owners
+from metrics import Gauge, Histogram, render_metrics
+from tracing import get_spans, inject_headers
+from profiler import sample_stacks, to_collapsed, to_summary
 
 router = APIRouter()
 
+CLIENT_SECONDS = Histogram("carbitrage_client_request_seconds", "Latency of /client requests", labels=("cache",))
+STARTUP_TO_READY = Gauge("carbitrage_startup_to_ready_seconds", "Time from process start until the node first became ready")
+
+# Startup checks behind /ready; records the start-to-ready time the first time they all pass
+def readiness():
+    node = raft_instance.raft_node
+    checks = {
+        "log_loaded": node is not None and node.log_loaded,
+        "cache_index_built": cache_index.is_built(),
+        "leader_known": get_leader() is not None,
+    }
+    ready = all(checks.values())
+    if ready and state.READY_AT is None:
+        state.READY_AT = time.monotonic()
+        STARTUP_TO_READY.set(state.READY_AT - state.STARTED_AT)
+        print(f"[Startup] Node {state.NODE_ID} ready {state.READY_AT - state.STARTED_AT:.2f}s after start")
+    return ready, checks
+
+# Prometheus metrics
+@router.get("/metrics")
+def metrics_route():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# Recent trace spans on this node, or gathered from every member with cluster=true
+@router.get("/debug/traces")
+def traces_route(trace_id: str = None, limit: int = 200, cluster: bool = False):
+    spans = [dict(s.to_wire(), node=state.NODE_ID) for s in get_spans(trace_id, limit)]
+    if cluster:
+        for nid in raft_instance.raft_node.config.members():
+            if nid == state.NODE_ID:
+                continue
+            try:
+                res = requests.get(f"{raft_instance.raft_node.peer_url(nid)}/debug/traces", params={"trace_id": trace_id, "limit": limit}, timeout=2)
+                spans.extend(res.json().get("spans", []))
+            except Exception:
+                print(f"[Trace] Could not collect spans from Node {nid}")
+    spans.sort(key=lambda s: s["start"])
+    return FastJSONResponse({"trace_id": trace_id, "spans": spans})
+
+# Sampling CPU profile of this node for the given number of seconds
+@router.get("/debug/profile")
+def profile_route(seconds: float = 5.0, format: str = "collapsed", interval: float = 0.005):
+    seconds = min(max(seconds, 0.1), 60.0)
+    stacks = sample_stacks(seconds, max(interval, 0.001))
+    if format == "collapsed":
+        return PlainTextResponse(to_collapsed(stacks))
+    return FastJSONResponse({"node_id": state.NODE_ID, "seconds": seconds, **to_summary(stacks)})
+
 # Health check endpoint
 @router.get("/health")
 def health():
-    return {"status": "ok", "node_id": NODE_ID}
+    return {"status": "ok", "node_id": state.NODE_ID}
+
+# Readiness probe, 503 until the node can serve requests
+@router.get("/ready")
+def ready_route():
+    ready, checks = readiness()
+    body = {
+        "ready": ready,
+        "node_id": state.NODE_ID,
+        "checks": checks,
+        "startup_seconds": state.READY_AT - state.STARTED_AT if state.READY_AT else None,
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
 
 # Get current leader
 @router.get("/leader")
 def get_leader_route():
-    return {"leader_id": get_leader(), "this_node": NODE_ID}
+    return {"leader_id": get_leader(), "this_node": state.NODE_ID}
 
 # Fetch cars from single city
 @router.post("/fetch")
@@ -30,21 +105,138 @@ def fetch(data: FetchRequest):
     )
     return {"num_cars": len(cars), "city": data.city, "model": data.model}
 
+# Owners to route a cache key to in sharded mode, live ones first (empty when served here)
+def _remote_owners(make, model, city):
+    if not SHARDING_ENABLED:
+        return []
+    owners = route_owners(cache_filename(make, model, city))
+    return [] if state.NODE_ID in owners else owners
+
+# Whether this node can serve the key from its cache without a MarketCheck crawl
+def _cached_here(make, model, city):
+    return is_recent(os.path.join(state.CACHE_DIR, cache_filename(make, model, city)))
+
+# Fetch one city's listings here, or from an owning node in sharded mode.
+# Returns the listings and whether the node that served them had them cached.
+def _fetch_city(country, city, make, model):
+    payload = {"country": country, "city": city, "make": make, "model": model}
+    for nid in _remote_owners(make, model, city):
+        try:
+            res = requests.post(f"{raft_instance.raft_node.peer_url(nid)}/shard/listings", json=payload, headers=inject_headers(), timeout=60)
+            if res.status_code == 200:
+                body = res.json()
+                return body["listings"], body.get("cached", False)
+        except requests.exceptions.RequestException:
+            print(f"[Shard] Owner Node {nid} unreachable for {city}, trying next")
+    cached = _cached_here(make, model, city)
+    return fetch_cars(country, city, make, model), cached
+
+def _iter_city(country, city, make, model):
+    if _remote_owners(make, model, city):
+        return iter(_fetch_city(country, city, make, model)[0])
+    return iter_cars(country, city, make, model)
+
+# Listings for a key this node owns, used for sharded routing
+@router.post("/shard/listings")
+def shard_listings(data: FetchRequest):
+    cached = _cached_here(data.make, data.model, data.city)
+    return FastJSONResponse({"listings": fetch_cars(data.country, data.city, data.make, data.model), "cached": cached})
+
 # Compare car prices between cities
 @router.post("/client")
 def client_entry(data: ClientRequest):
-    if NODE_ID != get_leader():
+    if state.NODE_ID != get_leader():
         return {"error": "This node is not the leader", "leader_id": get_leader()}
 
-    cars1 = fetch_cars(data.country, data.city1, data.make, data.model)
-    cars2 = fetch_cars(data.country, data.city2, data.make, data.model)
+    start = time.perf_counter()
+    cars1, cached1 = _fetch_city(data.country, data.city1, data.make, data.model)
+    cars2, cached2 = _fetch_city(data.country, data.city2, data.make, data.model)
+    CLIENT_SECONDS.labels("hit" if cached1 and cached2 else "miss").observe(time.perf_counter() - start)
 
-    return {
+    return FastJSONResponse({
         "leader_id": get_leader(),
         "results": {
             data.city1: cars1,
             data.city2: cars2
         }
+    })
+
+# Stream the two-city comparison as NDJSON, one listing per line
+@router.post("/client/stream")
+def client_stream_entry(data: ClientRequest):
+    if state.NODE_ID != get_leader():
+        return {"error": "This node is not the leader", "leader_id": get_leader()}
+
+    def generate():
+        yield dumps_json({"type": "meta", "leader_id": get_leader(), "cities": [data.city1, data.city2]}) + b"\n"
+        for city in (data.city1, data.city2):
+            count = 0
+            for car in _iter_city(data.country, city, data.make, data.model):
+                count += 1
+                yield dumps_json({"type": "listing", "city": city, "car": car}) + b"\n"
+            yield dumps_json({"type": "city_done", "city": city, "count": count}) + b"\n"
+        yield dumps_json({"type": "done"}) + b"\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+# Filtered, sorted and paginated listing query
+@router.post("/query")
+def query_entry(data: QueryRequest, request: Request):
+    owners = [] if request.headers.get(FORWARDED_HEADER) else _remote_owners(data.make, data.model, data.city)
+    for nid in owners:
+        try:
+            res = requests.post(
+                f"{raft_instance.raft_node.peer_url(nid)}/query",
+                json=data.model_dump(),
+                headers=inject_headers({FORWARDED_HEADER: str(state.NODE_ID)}),
+                timeout=60,
+            )
+            return Response(res.content, status_code=res.status_code, media_type="application/json")
+        except requests.exceptions.RequestException:
+            print(f"[Shard] Owner Node {nid} unreachable for query, trying next")
+
+    try:
+        result = run_query(data, allow_fetch=state.NODE_ID == get_leader() or SHARDING_ENABLED)
+    except QueryError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if result is None:
+        return {"error": "Listings not cached on this node", "leader_id": get_leader()}
+    return FastJSONResponse(result)
+
+# Cluster membership
+@router.get("/cluster")
+def cluster_route():
+    return {
+        "leader_id": get_leader(),
+        "this_node": state.NODE_ID,
+        "config_index": raft_instance.raft_node.config_index,
+        "match_index": {str(nid): idx for nid, idx in raft_instance.raft_node.match_index.items()},
+        **raft_instance.raft_node.config.describe(),
+    }
+
+@router.post("/cluster/add")
+def cluster_add(data: MembershipRequest):
+    if not data.address:
+        return JSONResponse({"error": "address (host:port) is required"}, status_code=400)
+    error = raft_instance.raft_node.add_learner(data.node_id, data.address)
+    if error:
+        return {"error": error, "leader_id": get_leader()}
+    return {"status": "ok", "message": f"Node {data.node_id} added as learner, promoted once caught up"}
+
+@router.post("/cluster/remove")
+def cluster_remove(data: MembershipRequest):
+    error = raft_instance.raft_node.remove_node(data.node_id)
+    if error:
+        return {"error": error, "leader_id": get_leader()}
+    return {"status": "ok", "message": f"Removing Node {data.node_id} via joint consensus"}
+
+# Peer liveness as seen by this node's failure detector
+@router.get("/membership")
+def membership_route():
+    return {
+        "this_node": state.NODE_ID,
+        "leader_id": get_leader(),
+        "nodes": raft_instance.raft_node.membership.describe(raft_instance.raft_node.config.members()),
     }
 
 # Update cluster leader
@@ -58,16 +250,13 @@ async def set_leader_route(request: Request):
 
 # Cache replication
 @router.post("/replicate")
-async def replicate_cache(file: UploadFile = File(...), filename: str = Form(...)):
+async def replicate_cache(file: UploadFile = File(...), filename: str = Form(...), version: int = Form(None)):
     try:
         contents = await file.read()
-        os.makedirs(CACHE_DIR, exist_ok=True)
-        filepath = os.path.join(CACHE_DIR, filename)
-
-        with open(filepath, "wb") as f:
-            f.write(contents)
+        os.makedirs(state.CACHE_DIR, exist_ok=True)
+        cache_store.write_file(filename, contents, version)
 
-        print(f"[Replication] Saved replicated cache to {filepath}")
+        print(f"[Replication] Saved replicated cache to {os.path.join(state.CACHE_DIR, filename)}")
         return {"status": "ok"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -75,74 +264,114 @@ async def replicate_cache(file: UploadFile = File(...), filename: str = Form(...
 # Cache management endpoints
 @router.get("/list-cache")
 def list_cache_files():
-    files = [f for f in os.listdir(CACHE_DIR) if f.endswith(".csv")]
-    return {"files": files}
+    return {"files": cache_index.files()}
+
+# Widest buy-city/sell-city spreads for every cached model, or one make/model
+@router.get("/arbitrage")
+def arbitrage_route(make: str = None, model: str = None, metric: str = "price", top: int = 10, pairs: int = 3, min_listings: int = 3, rank_by: str = "spread"):
+    if metric not in METRICS:
+        return JSONResponse({"error": f"metric must be one of {', '.join(METRICS)}"}, status_code=400)
+    if rank_by not in ("spread", "spread_pct"):
+        return JSONResponse({"error": "rank_by must be spread or spread_pct"}, status_code=400)
+    start = time.perf_counter()
+    result = SCANNER.scan(make, model, metric, max(top, 1), max(pairs, 1), max(min_listings, 1), rank_by)
+    result["scan_ms"] = (time.perf_counter() - start) * 1000
+    return FastJSONResponse({"node_id": state.NODE_ID, **result})
+
+# Per-city price and price/km distributions for one make/model
+@router.get("/arbitrage/distributions")
+def arbitrage_distributions_route(make: str, model: str):
+    return FastJSONResponse({"make": make, "model": model, "cities": SCANNER.distributions(make, model)})
+
+# Price trend for one make/model/city from the history rollups
+@router.get("/history")
+def history_route(make: str, model: str, city: str, bucket: str = "day", window: int = 7, since: int = None, until: int = None):
+    if bucket not in price_history.BUCKETS:
+        return JSONResponse({"error": f"bucket must be one of {', '.join(price_history.BUCKETS)}"}, status_code=400)
+    start = time.perf_counter()
+    result = price_history.trend(make, model, city, bucket, max(window, 1), since, until)
+    result["query_ms"] = (time.perf_counter() - start) * 1000
+    return FastJSONResponse({"node_id": state.NODE_ID, **result})
+
+# make_model_city keys with recorded history
+@router.get("/history/keys")
+def history_keys_route():
+    return {"keys": price_history.keys()}
+
+# Per-file size and access stats, quota and tombstones of evicted files
+@router.get("/cache-stats")
+def cache_stats():
+    return FastJSONResponse({"node_id": state.NODE_ID, **cache_manager.describe()})
 
 @router.get("/get-cache-file")
 def get_cache_file(filename: str):
     from fastapi.responses import FileResponse
-    filepath = os.path.join(CACHE_DIR, filename)
+    filepath = os.path.join(state.CACHE_DIR, filename)
     if os.path.exists(filepath):
         return FileResponse(filepath, media_type='text/csv', filename=filename)
     return {"error": "File not found"}, 404
 
 @router.get("/cache-meta")
 def get_cache_meta(filename: str):
-    filepath = os.path.join(CACHE_DIR, filename)
+    filepath = os.path.join(state.CACHE_DIR, filename)
     if os.path.exists(filepath):
-        return {"filename": filename, "mtime": os.path.getmtime(filepath)}
+        meta = cache_store.read_meta(filename) or {}
+        return {
+            "filename": filename,
+            "mtime": os.path.getmtime(filepath),
+            "version": meta.get("version", cache_index.version(filename)),
+            "sha256": meta.get("sha256"),
+        }
     return {"error": "File not found"}, 404
 
 # Cache reconciliation
 @router.post("/reconcile")
 async def reconcile_route(request: Request):
-    import requests
     from fastapi.responses import JSONResponse
 
-    if NODE_ID != get_leader():
+    if state.NODE_ID != get_leader():
         return {"error": "Only the leader can perform reconciliation."}
 
-    leader_files = {
-        f: os.path.getmtime(os.path.join(CACHE_DIR, f))
-        for f in os.listdir(CACHE_DIR)
-        if f.endswith(".csv")
-    }
+    leader_files = {f: cache_index.version(f) for f in cache_index.files()}
 
     updates = []
 
-    for nid, port in CLUSTER_NODES.items():
-        if nid == NODE_ID:
+    for nid in raft_instance.raft_node.config.members():
+        if nid == state.NODE_ID:
             continue
+        base_url = raft_instance.raft_node.peer_url(nid)
 
-        try:
-            health = requests.get(f"http://localhost:{port}/health", timeout=2)
-            if health.status_code != 200:
-                print(f"[Reconcile Skipped] Node {nid} is not healthy.")
-                continue
-        except Exception:
+        if raft_instance.raft_node.membership.status(nid) == "dead":
             print(f"[Reconcile Skipped] Node {nid} is offline.")
             continue
 
         try:
-            res = requests.get(f"http://localhost:{port}/list-cache", timeout=5)
+            res = requests.get(f"{base_url}/list-cache", timeout=5)
             their_files = res.json().get("files", [])
 
             for fname in their_files:
-                meta_res = requests.get(f"http://localhost:{port}/cache-meta", params={"filename": fname}, timeout=5)
+                if SHARDING_ENABLED and state.NODE_ID not in owners_for(fname):
+                    continue
+                meta_res = requests.get(f"{base_url}/cache-meta", params={"filename": fname}, timeout=5)
                 if meta_res.status_code != 200:
                     continue
                 meta_json = meta_res.json()
-                if "mtime" not in meta_json:
+                if meta_json.get("version") is None:
                     continue
 
-                their_mtime = float(meta_json["mtime"])
-                our_mtime = leader_files.get(fname, 0)
+                # Versions are fetch times carried with the data, so a replica
+                # that merely wrote its copy later does not look newer
+                their_version = int(meta_json["version"])
+                our_version = leader_files.get(fname) or 0
 
-                if their_mtime > our_mtime:
-                    file_data = requests.get(f"http://localhost:{port}/get-cache-file", params={"filename": fname}, timeout=10)
-                    if file_data.status_code == 200:
-                        with open(os.path.join(CACHE_DIR, fname), "wb") as f:
-                            f.write(file_data.content)
+                # Stale copies of evicted files stay evicted
+                if cache_index.is_tombstoned(fname, their_version):
+                    continue
+                if their_version > our_version:
+                    file_data = requests.get(f"{base_url}/get-cache-file", params={"filename": fname}, timeout=10)
+                    if file_data.status_code == 200 and cache_store.matches(file_data.content, meta_json):
+                        cache_store.write_file(fname, file_data.content, their_version)
+                        leader_files[fname] = their_version
                         updates.append(fname)
                         print(f"[Reconcile] Pulled newer {fname} from Node {nid}")
         except Exception as e:
@@ -153,10 +382,14 @@ async def reconcile_route(request: Request):
 # Raft protocol endpoints
 @router.post("/raft/append_entries")
 async def append_entries(request: Request):
-    data = await request.json()
-    return raft_node.handle_append_entries(data)
+    data, content_type = await read_rpc(request)
+    if data is None:
+        return Response(status_code=415)
+    return rpc_response(request, raft_instance.raft_node.handle_append_entries(data), content_type)
 
 @router.post("/raft/request_vote")
 async def request_vote(request: Request):
-    data = await request.json()
-    return raft_node.handle_request_vote(data)
+    data, content_type = await read_rpc(request)
+    if data is None:
+        return Response(status_code=415)
+    return rpc_response(request, raft_instance.raft_node.handle_request_vote(data), content_type)
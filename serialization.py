@@ -0,0 +1,76 @@
+# serialization.py
+import json
+from fastapi import Request
+from fastapi.responses import Response
+
+# Optional fast codecs, falling back to the standard library when not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+
+# Encode values the codecs don't know natively
+def _default(obj):
+    if hasattr(obj, "to_wire"):
+        return obj.to_wire()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+# JSON to bytes, via orjson when available
+def dumps_json(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, separators=(",", ":"), default=_default).encode()
+
+def loads_json(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# JSON response that skips FastAPI's jsonable_encoder pass
+class FastJSONResponse(Response):
+    media_type = JSON_TYPE
+
+    def render(self, content) -> bytes:
+        return dumps_json(content)
+
+# Preferred wire format for Raft RPCs sent by this node
+def preferred_rpc_type() -> str:
+    return MSGPACK_TYPE if msgpack is not None else JSON_TYPE
+
+def supports(content_type: str) -> bool:
+    return content_type != MSGPACK_TYPE or msgpack is not None
+
+def encode_rpc(obj, content_type: str) -> bytes:
+    if content_type == MSGPACK_TYPE:
+        return msgpack.packb(obj, default=_default, use_bin_type=True)
+    return dumps_json(obj)
+
+def decode_rpc(body: bytes, content_type: str):
+    if content_type == MSGPACK_TYPE:
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    return loads_json(body)
+
+# Decode an incoming RPC body according to its Content-Type
+async def read_rpc(request: Request):
+    content_type = request.headers.get("content-type", JSON_TYPE).split(";")[0].strip()
+    if not supports(content_type):
+        return None, content_type
+    return decode_rpc(await request.body(), content_type), content_type
+
+# Reply in the format the caller asked for, defaulting to the request's own
+def rpc_response(request: Request, obj, request_type: str = JSON_TYPE) -> Response:
+    accept = request.headers.get("accept", "")
+    content_type = MSGPACK_TYPE if MSGPACK_TYPE in accept and msgpack is not None else request_type
+    if not supports(content_type):
+        content_type = JSON_TYPE
+    return Response(encode_rpc(obj, content_type), media_type=content_type)
@@ -0,0 +1,152 @@
+# sharding.py
+import bisect
+import hashlib
+import os
+import threading
+import time
+import requests
+from config import REPLICATION_FACTOR, VIRTUAL_NODES
+import cache_index
+import cache_store
+import raft_instance
+import state
+
+# Set on requests forwarded to a key's owner. Rings are built from each node's
+# own view of the live members and can disagree for a while around a join or
+# failure, so a forwarded request is served where it lands, never forwarded again.
+FORWARDED_HEADER = "X-Shard-Forwarded"
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+# Consistent hash ring with virtual nodes
+class HashRing:
+    def __init__(self, nodes, vnodes=VIRTUAL_NODES):
+        self.nodes = frozenset(nodes)
+        self._points = sorted((_hash(f"{nid}#{v}"), nid) for nid in self.nodes for v in range(vnodes))
+        self._hashes = [h for h, _ in self._points]
+
+    def owners(self, key, count=REPLICATION_FACTOR):
+        """Return the distinct nodes clockwise from the key's position"""
+        if not self._points:
+            return []
+        count = min(count, len(self.nodes))
+        owners = []
+        i = bisect.bisect(self._hashes, _hash(key))
+        while len(owners) < count:
+            nid = self._points[i % len(self._points)][1]
+            if nid not in owners:
+                owners.append(nid)
+            i += 1
+        return owners
+
+# Ring over the configured members (raft config, not liveness, so a slow or
+# just-started node doesn't reshuffle ownership), rebuilt when the config changes
+_ring = None
+_ring_lock = threading.Lock()
+
+def _current_ring():
+    global _ring
+    with _ring_lock:
+        if _ring is None:
+            _ring = HashRing(raft_instance.raft_node.config.members())
+        return _ring
+
+def update_membership(members) -> bool:
+    global _ring
+    members = frozenset(members)
+    _current_ring()
+    with _ring_lock:
+        if members == _ring.nodes:
+            return False
+        _ring = HashRing(members)
+    print(f"[Shard] Membership changed, ring now has nodes {sorted(members)}")
+    return True
+
+def owners_for(filename):
+    return _current_ring().owners(filename)
+
+def is_owner(filename, node_id=None):
+    return (state.NODE_ID if node_id is None else node_id) in owners_for(filename)
+
+# Owners to route a request to, the ones the failure detector thinks are up first
+def route_owners(filename):
+    membership = raft_instance.raft_node.membership
+    return sorted(owners_for(filename), key=lambda nid: membership.status(nid) == "dead")
+
+# Send a cache file straight to its other owners instead of through the Raft log
+def push_to_owners(filepath, filename):
+    with open(filepath, "rb") as f:
+        contents = f.read()
+    version = cache_index.version(filename)
+    for nid in owners_for(filename):
+        if nid == state.NODE_ID:
+            continue
+        try:
+            requests.post(
+                f"{raft_instance.raft_node.peer_url(nid)}/replicate",
+                files={"file": (filename, contents)},
+                data={"filename": filename, "version": version},
+                timeout=5
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"[Shard] Could not push '{filename}' to Node {nid}: {e}")
+
+# Version of a peer's copy: 0 if it has none, None if it couldn't be asked
+def _peer_version(nid, filename):
+    try:
+        res = requests.get(f"{raft_instance.raft_node.peer_url(nid)}/cache-meta", params={"filename": filename}, timeout=2)
+        meta = res.json()
+    except Exception:
+        return None
+    return (meta.get("version") or 0) if isinstance(meta, dict) else 0
+
+# Move local files to their current owners and drop the ones we no longer own
+def rebalance():
+    moved, dropped = 0, 0
+    for filename in cache_index.files():
+        filepath = os.path.join(state.CACHE_DIR, filename)
+        owners = owners_for(filename)
+        version = cache_index.version(filename) or 0
+        placed = True
+        for nid in owners:
+            if nid == state.NODE_ID:
+                continue
+            peer_version = _peer_version(nid, filename)
+            if peer_version is None:
+                placed = False
+                continue
+            # Owners with a copy at least as new as ours keep it; older copies are replaced
+            if peer_version >= version:
+                continue
+            try:
+                with open(filepath, "rb") as f:
+                    res = requests.post(
+                        f"{raft_instance.raft_node.peer_url(nid)}/replicate",
+                        files={"file": (filename, f.read())},
+                        data={"filename": filename, "version": cache_index.version(filename)},
+                        timeout=5
+                    )
+                if res.status_code == 200:
+                    moved += 1
+                else:
+                    placed = False
+            except requests.exceptions.RequestException:
+                placed = False
+        # Only give up our copy once every owner is confirmed to hold it at our version or newer
+        if state.NODE_ID not in owners and placed:
+            cache_store.remove_file(filename)
+            dropped += 1
+    print(f"[Shard] Rebalance done: {moved} files moved, {dropped} files dropped")
+
+# Background thread that rebalances when the cluster config's members change
+def start_rebalancer(interval=10):
+    def watch_membership():
+        while True:
+            if update_membership(raft_instance.raft_node.config.members()):
+                try:
+                    rebalance()
+                except Exception as e:
+                    print(f"[Shard] Rebalance failed: {e}")
+            time.sleep(interval)
+    threading.Thread(target=watch_membership, daemon=True).start()
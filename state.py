@@ -1,26 +1,52 @@
 # state.py
-import os
 import random
 import sys
+import time
 from config import CLUSTER_NODES
 from raft import NodeState
 
-# Assign or verify node identity
-if len(sys.argv) > 1:
-    NODE_ID = int(sys.argv[1])
-    if NODE_ID not in CLUSTER_NODES:
-        raise ValueError(f"NODE_ID {NODE_ID} not in CLUSTER_NODES")
-else:
-    NODE_ID = random.choice(list(CLUSTER_NODES.keys()))
+# Node identity, filled in by configure() when the node starts. Read these
+# as state.NODE_ID etc. so importers see the configured values.
+NODE_ID = None
+NODE_ADDRESS = None
+NODE_PORT = None
+CACHE_DIR = None
+HISTORY_DIR = None
 
-NODE_PORT = CLUSTER_NODES[NODE_ID]
+# Process start and first readiness, for measuring cold start-to-ready time
+STARTED_AT = time.monotonic()
+READY_AT = None
 
-# Set up node-specific cache directory
-CACHE_DIR = f"cache/node_{NODE_ID}"
-os.makedirs(CACHE_DIR, exist_ok=True)
+# Assign or verify node identity (nodes outside CLUSTER_NODES pass their host:port to join)
+def configure(argv=None):
+    global NODE_ID, NODE_ADDRESS, NODE_PORT, CACHE_DIR, HISTORY_DIR
+    if NODE_ID is not None:
+        return
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        node_id = int(argv[0])
+        if len(argv) > 1:
+            address = argv[1]
+        elif node_id in CLUSTER_NODES:
+            address = CLUSTER_NODES[node_id]
+        else:
+            raise ValueError(f"NODE_ID {node_id} not in CLUSTER_NODES, pass its host:port to join")
+    else:
+        node_id = random.choice(list(CLUSTER_NODES.keys()))
+        address = CLUSTER_NODES[node_id]
+
+    NODE_ID = node_id
+    NODE_ADDRESS = address
+    NODE_PORT = int(address.rsplit(":", 1)[1])
+    # Node-specific cache directory, created at startup
+    CACHE_DIR = f"cache/node_{node_id}"
+    # Append-only price history, kept out of the cache so eviction never touches it
+    HISTORY_DIR = f"history/node_{node_id}"
 
 def get_leader():
     from raft_instance import raft_node
+    if raft_node is None:
+        return None
     if raft_node.state == NodeState.LEADER:
         return NODE_ID
     # If we're a follower and have received append entries, return the known leader
@@ -30,7 +56,7 @@ def get_leader():
 
 def set_leader(new_id):
     from raft_instance import raft_node
-    if raft_node.state == NodeState.LEADER:
+    if raft_node is not None and raft_node.state == NodeState.LEADER:
         raft_node.append_command({
             "type": "set_leader",
             "leader_id": new_id
@@ -0,0 +1,95 @@
+# tracing.py
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Optional
+
+TRACE_HEADER = "X-Trace-Id"
+PARENT_HEADER = "X-Parent-Span-Id"
+
+# Recently finished spans on this node, newest last
+MAX_SPANS = 5000
+_finished = deque(maxlen=MAX_SPANS)
+_finished_lock = threading.Lock()
+_current = contextvars.ContextVar("current_span", default=None)
+
+def new_id() -> str:
+    return os.urandom(8).hex()
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float
+    duration: float = 0.0
+    thread: str = ""
+    attributes: dict = field(default_factory=dict)
+
+    def to_wire(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "thread": self.thread,
+            "attributes": self.attributes,
+        }
+
+def _finish(s: Span):
+    with _finished_lock:
+        _finished.append(s)
+
+# Time a block as a span, child of the current span or of an explicit remote parent
+@contextmanager
+def span(name, trace_id=None, parent_id=None, **attributes):
+    parent = _current.get()
+    if trace_id is None and parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    s = Span(name, trace_id or new_id(), new_id(), parent_id, time.time(),
+             thread=threading.current_thread().name, attributes=attributes)
+    token = _current.set(s)
+    started = time.perf_counter()
+    try:
+        yield s
+    finally:
+        s.duration = time.perf_counter() - started
+        _current.reset(token)
+        _finish(s)
+
+# Record an already-measured span (e.g. work spread across generator steps)
+def record(name, duration, **attributes):
+    parent = _current.get()
+    if parent is None:
+        return
+    _finish(Span(name, parent.trace_id, new_id(), parent.span_id, time.time() - duration, duration,
+                 threading.current_thread().name, attributes))
+
+def current_context() -> Optional[dict]:
+    """Trace/span IDs to propagate to another node, or None outside a trace"""
+    s = _current.get()
+    if s is None:
+        return None
+    return {"trace_id": s.trace_id, "span_id": s.span_id}
+
+def inject_headers(headers: Optional[dict] = None) -> dict:
+    headers = dict(headers or {})
+    ctx = current_context()
+    if ctx:
+        headers[TRACE_HEADER] = ctx["trace_id"]
+        headers[PARENT_HEADER] = ctx["span_id"]
+    return headers
+
+def get_spans(trace_id=None, limit=200):
+    with _finished_lock:
+        spans = list(_finished)
+    if trace_id:
+        spans = [s for s in spans if s.trace_id == trace_id]
+    return spans[-limit:]